@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 import os
 import argparse
+import itertools
+import multiprocessing
 from BCBio import GFF
 from Bio import SeqIO
 from Bio.SeqRecord import SeqRecord
@@ -54,20 +56,43 @@ def gen_relationships(blast):
 
 
 def cluster_relationships(data):
-    generated_clusters_ids = []
-
-    for relationship in data:
-        hit = False
-        relationship_set = set((relationship['from'], relationship['to']))
-        for idx, cluster in enumerate(generated_clusters_ids):
-            if relationship['from'] in cluster or relationship['to'] in cluster:
-                generated_clusters_ids[idx] = cluster.__or__(relationship_set)
-                hit = True
-                break
-
-        if not hit:
-            generated_clusters_ids.append(relationship_set)
-    return generated_clusters_ids
+    """Single linkage clusters of the features in BLAST relationships.
+
+    This is a union-find over feature IDs, so each relationship is (nearly)
+    constant work, and features linked through any chain of hits end up in
+    the same cluster. Clusters are returned in the order they were first
+    seen.
+    """
+    parents = {}
+    first_seen = {}
+
+    def find(feature):
+        root = feature
+        while parents[root] != root:
+            root = parents[root]
+        # Path compression
+        while parents[feature] != root:
+            parents[feature], feature = root, parents[feature]
+        return root
+
+    for idx, relationship in enumerate(data):
+        for feature in (relationship['from'], relationship['to']):
+            if feature not in parents:
+                parents[feature] = feature
+                first_seen[feature] = idx
+
+        a = find(relationship['from'])
+        b = find(relationship['to'])
+        if a != b:
+            # The earlier seen root stays the root, so it orders the cluster.
+            if first_seen[b] < first_seen[a]:
+                a, b = b, a
+            parents[b] = a
+
+    clusters = {}
+    for feature in parents:
+        clusters.setdefault(find(feature), set()).add(feature)
+    return [clusters[root] for root in sorted(clusters, key=lambda root: first_seen[root])]
 
 
 def align_sequences(SequenceList):
@@ -112,12 +137,34 @@ def align_sequences(SequenceList):
         return None
 
 
+def align_clusters(jobs, threads=1):
+    """Align each list of sequences in jobs, yielding the alignments in the
+    same order.
+
+    Alignments run on a pool of `threads` processes, so at most that many
+    ClustalW processes run at once. Results are yielded in order as they
+    finish.
+    """
+    if threads > 1:
+        pool = multiprocessing.Pool(threads)
+        results = pool.imap(align_sequences, jobs)
+    else:
+        pool = None
+        results = itertools.imap(align_sequences, jobs)
+
+    for result in results:
+        yield result
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
 def split_by_n(seq, n):
     """A generator to divide a sequence into chunks of n units."""
     # http://stackoverflow.com/questions/9475241/split-python-string-every-nth-character
-    while seq:
-        yield seq[:n]
-        seq = seq[n:]
+    for i in range(0, len(seq), n):
+        yield seq[i:i + n]
 
 
 def larger_than_one(it):
@@ -159,7 +206,7 @@ class XmfaWriter(object):
         self.output.write('=\n')
 
 
-def blast2pxmfa(blast, fasta, gff3, output, genomic=False):
+def blast2pxmfa(blast, fasta, gff3, output, genomic=False, threads=1):
     logging.info("Parsing sequence")
     locations = parse_gff3(gff3, fasta)
     logging.info("Parsed locations, clustering")
@@ -178,23 +225,27 @@ def blast2pxmfa(blast, fasta, gff3, output, genomic=False):
         specific = locations[element]['loc'].start
         return general + specific
 
-    for idx, cluster in enumerate(clusters):
-        logging.debug('Cluster %s/%s, size=%s', idx + 1, len(clusters), len(cluster))
-        # We're considering 1 LCB :: 1 cluster
-        seqs = []
-        for element in cluster:
-            if element not in locations:
-                logging.warning("Could not find this feature %s", element)
-                continue
-
-            sr = SeqRecord(
-                locations[element]['seq'],
-                id=element,
-                description='[{0.start}:{0.end}:{0.strand}]'.format(locations[element]['loc'])
-            )
-            seqs.append(sr)
-
-        aligned_seqs = align_sequences(seqs)
+    def cluster_sequences():
+        for idx, cluster in enumerate(clusters):
+            logging.debug('Cluster %s/%s, size=%s', idx + 1, len(clusters), len(cluster))
+            # We're considering 1 LCB :: 1 cluster
+            seqs = []
+            for element in cluster:
+                if element not in locations:
+                    logging.warning("Could not find this feature %s", element)
+                    continue
+
+                sr = SeqRecord(
+                    locations[element]['seq'],
+                    id=element,
+                    description='[{0.start}:{0.end}:{0.strand}]'.format(locations[element]['loc'])
+                )
+                seqs.append(sr)
+            yield seqs
+
+    # Clusters are paired back up with their alignments here rather than sent
+    # to the workers, as their (set) ordering matters below.
+    for (cluster, aligned_seqs) in itertools.izip(clusters, align_clusters(cluster_sequences(), threads=threads)):
         if aligned_seqs is None:
             logging.error("Error aligning cluster [%s]", ''.join(cluster))
             continue
@@ -235,6 +286,7 @@ if __name__ == '__main__':
     parser.add_argument('gff3', type=argparse.FileType("r"), help='GFF3 Gene Calls')
     parser.add_argument('--genomic', action='store_true', help='Further reduce protein results into genomic-level results.')
     parser.add_argument('output', type=argparse.FileType('w'), help='Output file or - for stdout')
+    parser.add_argument('--threads', type=int, help='Number of clusters to align in parallel', default=1)
     args = parser.parse_args()
 
     blast2pxmfa(**vars(args))
@@ -117,9 +117,8 @@ SAM alignment mandatory fields
 
 import sys
 import copy
-from itertools import tee
 from math import log10
-from Bio.Blast import NCBIXML
+from blastxml import read_blastxml
 
 NOMAPQ = False
 def_qual = 'I'
@@ -200,13 +199,11 @@ def cigar(subject, query, queryStart, queryEnd, querySize):
     return ''.join(cigar_str)
 
 
-# use itertools.tee() because we need the list twice
-blast_records, blast_records_backup = tee(NCBIXML.parse(open(filein)))
-
-# read once to parse general info
+# read once to parse general info, and again for the alignments, rather
+# than keeping every record in memory between the two
 version = None
 references = {}
-for record in blast_records:
+for record in read_blastxml(open(filein)):
     if not version:
         version = record.version
         application = record.application
@@ -224,7 +221,7 @@ print('@PG\tID:%s\tVN:%s\tCL:%s' % (application, version, ' '.join(sys.argv)))
 
 counter = {}
 i = 0
-for record in blast_records_backup:
+for record in read_blastxml(open(filein)):
     for alignment in record.alignments:
         TC = len(alignment.hsps)  # SAM TC flag: segments in template
         for hsp in alignment.hsps:
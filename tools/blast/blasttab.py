@@ -0,0 +1,148 @@
+"""
+Streaming reader for 25 column BLAST tabular output (outfmt 6 or 7, with
+the column set below) and top-k ranking of hits, shared by the blast tools.
+"""
+import heapq
+import itertools
+import numpy
+
+COLUMNS = [
+    'qseqid',      # 01 Query Seq-id (ID of your sequence)
+    'sseqid',      # 02 Subject Seq-id (ID of the database hit)
+    'pident',      # 03 Percentage of identical matches
+    'length',      # 04 Alignment length
+    'mismatch',    # 05 Number of mismatches
+    'gapopen',     # 06 Number of gap openings
+    'qstart',      # 07 Start of alignment in query
+    'qend',        # 08 End of alignment in query
+    'sstart',      # 09 Start of alignment in subject (database hit)
+    'send',        # 10 End of alignment in subject (database hit)
+    'evalue',      # 11 Expectation value (E-value)
+    'bitscore',    # 12 Bit score
+    'sallseqid',   # 13 All subject Seq-id(s), separated by a ';'
+    'score',       # 14 Raw score
+    'nident',      # 15 Number of identical matches
+    'positive',    # 16 Number of positive-scoring matches
+    'gaps',        # 17 Total number of gaps
+    'ppos',        # 18 Percentage of positive-scoring matches
+    'qframe',      # 19 Query frame
+    'sframe',      # 20 Subject frame
+    'qseq',        # 21 Aligned part of query sequence
+    'sseq',        # 22 Aligned part of subject sequence
+    'qlen',        # 23 Query sequence length
+    'slen',        # 24 Subject sequence length
+    'salltitles',  # 25 All subject title(s), separated by a '<>'
+]
+
+INT_COLUMNS = set('gapopen gaps length mismatch nident positive qend qframe qlen qstart score send sframe slen sstart'.split(' '))
+FLOAT_COLUMNS = set('bitscore evalue pident ppos'.split(' '))
+
+CHUNK_SIZE = 10000
+
+
+def _column(name, values, typed):
+    if typed and name in INT_COLUMNS:
+        return numpy.array(values).astype(numpy.int64)
+    if typed and name in FLOAT_COLUMNS:
+        return numpy.array(values).astype(numpy.float64)
+    return values
+
+
+def _chunk(line_numbers, lines, wanted, typed, keep_lines):
+    # Only split as far as the last column we need, anything after that is
+    # left in one piece.
+    maxsplit = max([idx for (name, idx) in wanted] + [0]) + 1
+    rows = [line.rstrip('\n').split('\t', maxsplit) for line in lines]
+
+    chunk = {'_index': numpy.array(line_numbers, dtype=numpy.int64)}
+    for (name, idx) in wanted:
+        chunk[name] = _column(name, [row[idx] for row in rows], typed)
+    if keep_lines:
+        chunk['_line'] = lines
+    return chunk
+
+
+def read_blast(handle, columns=None, chunk_size=CHUNK_SIZE, typed=True, lines=False):
+    """Read BLAST tabular results in chunks of at most chunk_size hits.
+
+    Each chunk is a dictionary of column name (from COLUMNS) to that column
+    for the hits in the chunk. Only the requested columns are kept (all of
+    them by default). With typed=True the numeric columns are numpy int64 or
+    float64 arrays, everything else is a list of strings.
+
+    Comment and blank lines are skipped. '_index' holds the (zero based)
+    line number each hit came from, and with lines=True '_line' holds the
+    original lines, newlines and all.
+    """
+    if columns is None:
+        columns = COLUMNS
+    wanted = [(name, COLUMNS.index(name)) for name in columns]
+
+    line_numbers = []
+    chunk_lines = []
+    for line_number, line in enumerate(handle):
+        if line.startswith('#') or not line.strip():
+            continue
+
+        line_numbers.append(line_number)
+        chunk_lines.append(line)
+        if len(chunk_lines) >= chunk_size:
+            yield _chunk(line_numbers, chunk_lines, wanted, typed, lines)
+            line_numbers = []
+            chunk_lines = []
+
+    if chunk_lines:
+        yield _chunk(line_numbers, chunk_lines, wanted, typed, lines)
+
+
+def dice(chunk):
+    """Dice coefficient, 2 * identities / (query length + subject length), of
+    every hit in a chunk read with nident, qlen and slen."""
+    return 2 * chunk['nident'] / (chunk['qlen'] + chunk['slen']).astype(numpy.float64)
+
+
+def read_rows(handle, columns=None, chunk_size=CHUNK_SIZE, typed=True):
+    """Hits one at a time, as tuples of the requested columns (as read_blast)"""
+    if columns is None:
+        columns = COLUMNS
+    for chunk in read_blast(handle, columns=columns, chunk_size=chunk_size, typed=typed):
+        for row in zip(*[chunk[name] for name in columns]):
+            yield row
+
+
+class TopK(object):
+    """The k best scoring items for each key, in a single streaming pass.
+
+    Each key has a heap of at most k entries, with the worst kept entry at
+    its root, so memory is O(k * keys) however many items are added. Higher
+    scores are better (negate e-values). Of equally scored items, the one
+    added first ranks higher.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self.heaps = {}
+        self._order = []
+        self._counter = itertools.count()
+
+    def add(self, key, score, item):
+        if key not in self.heaps:
+            self.heaps[key] = []
+            self._order.append(key)
+        heap = self.heaps[key]
+        if self.k <= 0:
+            return
+        # Later additions sort lower on ties, so are evicted first.
+        entry = (score, -next(self._counter), item)
+        if len(heap) < self.k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    def keys(self):
+        """Keys in the order they were first seen"""
+        return list(self._order)
+
+    def top(self, key):
+        """Items for key, best first"""
+        return [item for (score, _, item) in sorted(self.heaps.get(key, []), reverse=True)]
@@ -0,0 +1,222 @@
+"""
+Streaming reader for BLAST XML output (outfmt 5), shared by the blast tools.
+
+This replaces Bio.Blast.NCBIXML.parse where only the hits and HSPs are
+needed. Records, hits and HSPs carry the same attribute names (and the same
+defaults) as Biopython's, but none of the descriptions, parameters or
+statistics are kept. Each query's elements are cleared once it has been
+read, so memory use depends on the largest query rather than the file.
+"""
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+XML_START = '<?xml'
+BLOCK = 65536
+
+
+class Hsp(object):
+    """One HSP, as in Bio.Blast.Record.HSP"""
+    score = None
+    bits = None
+    expect = None
+    identities = (None, None)
+    positives = (None, None)
+    gaps = (None, None)
+    align_length = None
+    strand = (None, None)
+    frame = ()
+    query = ''
+    query_start = None
+    query_end = None
+    match = ''
+    sbjct = ''
+    sbjct_start = None
+    sbjct_end = None
+
+
+class Hit(object):
+    """One database sequence and its HSPs, as in Bio.Blast.Record.Alignment"""
+
+    def __init__(self, hit_id='', hit_def='', accession=None, length=None, hsps=None):
+        self.hit_id = hit_id
+        self.hit_def = hit_def
+        self.title = hit_id + ' ' + hit_def
+        self.accession = accession
+        self.length = length
+        self.hsps = hsps or []
+
+
+class Record(object):
+    """The hits for one query, as in Bio.Blast.Record.Blast"""
+
+    def __init__(self, header, query, query_id, query_length, alignments):
+        self.application = header.get('application')
+        self.version = header.get('version')
+        self.query = query or header.get('query')
+        self.query_id = query_id or header.get('query_id')
+        self.query_length = self.query_letters = query_length or header.get('query_length')
+        self.alignments = alignments
+
+
+HSP_FIELDS = {
+    'Hsp_score': ('score', float),
+    'Hsp_bit-score': ('bits', float),
+    'Hsp_evalue': ('expect', float),
+    'Hsp_query-from': ('query_start', int),
+    'Hsp_query-to': ('query_end', int),
+    'Hsp_hit-from': ('sbjct_start', int),
+    'Hsp_hit-to': ('sbjct_end', int),
+    'Hsp_identity': ('identities', int),
+    'Hsp_positive': ('positives', int),
+    'Hsp_gaps': ('gaps', int),
+    'Hsp_align-len': ('align_length', int),
+    'Hsp_qseq': ('query', str),
+    'Hsp_hseq': ('sbjct', str),
+    'Hsp_midline': ('match', str),
+}
+
+
+def _hsp(elem):
+    hsp = Hsp()
+    values = hsp.__dict__
+    for child in elem:
+        field = HSP_FIELDS.get(child.tag)
+        if field is not None:
+            values[field[0]] = field[1](child.text or '')
+        elif child.tag == 'Hsp_query-frame':
+            hsp.frame = (int(child.text),)
+        elif child.tag == 'Hsp_hit-frame':
+            hsp.frame += (int(child.text),)
+    return hsp
+
+
+def _int(text):
+    if text:
+        return int(text)
+    return None
+
+
+def _children(elem, tag):
+    child = elem.find(tag)
+    if child is None:
+        return []
+    return list(child)
+
+
+def _hit(elem):
+    return Hit(
+        hit_id=elem.findtext('Hit_id', ''),
+        hit_def=elem.findtext('Hit_def', ''),
+        accession=elem.findtext('Hit_accession'),
+        length=_int(elem.findtext('Hit_len')),
+        hsps=[_hsp(hsp) for hsp in _children(elem, 'Hit_hsps')],
+    )
+
+
+def _record(header, elem):
+    return Record(
+        header,
+        elem.findtext('Iteration_query-def'),
+        elem.findtext('Iteration_query-ID'),
+        _int(elem.findtext('Iteration_query-len')),
+        [_hit(hit) for hit in _children(elem, 'Iteration_hits')],
+    )
+
+
+HEADER_TAGS = set([
+    'BlastOutput_program', 'BlastOutput_version', 'BlastOutput_query-def',
+    'BlastOutput_query-ID', 'BlastOutput_query-len',
+])
+
+
+def _header(header, elem):
+    if elem.tag == 'BlastOutput_program':
+        header['application'] = elem.text.upper()
+    elif elem.tag == 'BlastOutput_version':
+        # e.g. "BLASTP 2.2.28+"
+        header['version'] = elem.text.split()[1]
+    elif elem.tag == 'BlastOutput_query-def':
+        header['query'] = elem.text
+    elif elem.tag == 'BlastOutput_query-ID':
+        header['query_id'] = elem.text
+    elif elem.tag == 'BlastOutput_query-len':
+        header['query_length'] = _int(elem.text)
+
+
+class _Document(object):
+    """A file-like view of one XML document in a handle.
+
+    BLAST before 2.2.14 wrote one XML document per query, concatenated.
+    read() stops (returns an empty string) at the start of the next one.
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.text = handle.read(0)
+        self.started = False
+
+    def _fill(self):
+        if not self.text:
+            # Always end on a whole line, so a document's start isn't split
+            self.text = self.handle.read(BLOCK) + self.handle.readline()
+
+    def next_document(self):
+        """Skip to the next document, if there is one"""
+        self.started = False
+        while True:
+            self._fill()
+            if not self.text:
+                return False
+            self.text = self.text.lstrip()
+            if self.text:
+                return True
+
+    def read(self, size=-1):
+        self._fill()
+        text = self.text
+        (newline, start) = ('\n', XML_START)
+        if not isinstance(text, str):
+            (newline, start) = (newline.encode('ascii'), start.encode('ascii'))
+
+        if self.started and text.startswith(start):
+            return text[:0]
+        self.started = True
+
+        end = text.find(newline + start)
+        if end == -1:
+            self.text = text[:0]
+            return text
+        self.text = text[end + 1:]
+        return text[:end + 1]
+
+
+def _parse_document(document):
+    header = {}
+    # Only end events: asking for start events as well (to find and empty
+    # the parent of the Iterations) doubles the per element overhead. An
+    # emptied Iteration element is all that's kept of each query.
+    for (event, elem) in ElementTree.iterparse(document):
+        if elem.tag == 'Iteration':
+            # One query's hits are small enough to build as a tree and
+            # convert in one go, then they're dropped.
+            record = _record(header, elem)
+            elem.clear()
+            yield record
+        elif elem.tag in HEADER_TAGS:
+            _header(header, elem)
+
+
+def read_blastxml(handle):
+    """Yield a Record for each query in a BLAST XML file.
+
+    Records have query, query_id, query_length, application, version and
+    alignments (a list of Hit). Hits have hit_id, hit_def, title, accession,
+    length and hsps (a list of Hsp). Attribute names and conversions follow
+    Bio.Blast.NCBIXML.
+    """
+    document = _Document(handle)
+    while document.next_document():
+        for record in _parse_document(document):
+            yield record
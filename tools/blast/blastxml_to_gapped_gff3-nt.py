@@ -1,10 +1,10 @@
 #!/usr/bin/python
-import re
 import sys
 import copy
 import argparse
 import logging
 from BCBio import GFF
+from blastxml import read_blastxml
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(name='blastxml2gff3')
 
@@ -20,12 +20,11 @@ MATCH_TYPE = {  # Currently we can only handle BLASTN, BLASTP
 
 
 def blastxml2gff3(blastxml, min_gap=3, trim=False, trim_end=False, include_seq=False):
-    from Bio.Blast import NCBIXML
     from Bio.Seq import Seq
     from Bio.SeqRecord import SeqRecord
     from Bio.SeqFeature import SeqFeature, FeatureLocation
 
-    blast_records = NCBIXML.parse(blastxml)
+    blast_records = read_blastxml(blastxml)
     for idx_record, record in enumerate(blast_records):
         # http://www.sequenceontology.org/browser/release_2.4/term/SO:0000343
         MATCH_TYPE.get(record.application, 'match')
@@ -101,136 +100,6 @@ def blastxml2gff3(blastxml, min_gap=3, trim=False, trim_end=False, include_seq=F
         yield rec
 
 
-def __remove_query_gaps(query, match, subject):
-    """remove positions in all three based on gaps in query
-
-    In order to simplify math and calculations...we remove all of the gaps
-    based on gap locations in the query sequence::
-
-        Q:ACTG-ACTGACTG
-        S:ACTGAAC---CTG
-
-    will become::
-
-        Q:ACTGACTGACTG
-        S:ACTGAC---CTG
-
-    which greatly simplifies the process of identifying the correct location
-    for a match_part
-    """
-    prev = 0
-    fq = ''
-    fm = ''
-    fs = ''
-    for position in re.finditer('-', query):
-        fq += query[prev:position.start()]
-        fm += match[prev:position.start()]
-        fs += subject[prev:position.start()]
-        prev = position.start() + 1
-    fq += query[prev:]
-    fm += match[prev:]
-    fs += subject[prev:]
-
-    return (fq, fm, fs)
-
-
-def generate_parts(query, match, subject, ignore_under=3):
-    region_q = []
-    region_m = []
-    region_s = []
-
-    (query, match, subject) = __remove_query_gaps(query, match, subject)
-
-    region_start = -1
-    region_end = -1
-    mismatch_count = 0
-    for i, (q, m, s) in enumerate(zip(query, match, subject)):
-
-        # If we have a match
-        if m != ' ' or m == '+':
-            if region_start == -1:
-                region_start = i
-                # It's a new region, we need to reset or it's pre-seeded with
-                # spaces
-                region_q = []
-                region_m = []
-                region_s = []
-            region_end = i
-            mismatch_count = 0
-        else:
-            mismatch_count += 1
-
-        region_q.append(q)
-        region_m.append(m)
-        region_s.append(s)
-
-        if mismatch_count >= ignore_under and region_start != -1 and region_end != -1:
-            region_q = region_q[0:-ignore_under]
-            region_m = region_m[0:-ignore_under]
-            region_s = region_s[0:-ignore_under]
-            yield region_start, region_end + 1, \
-                cigar_from_string(region_q, region_m, region_s, strict_m=True)
-            region_q = []
-            region_m = []
-            region_s = []
-
-            region_start = -1
-            region_end = -1
-            mismatch_count = 0
-
-    yield region_start, region_end + 1, \
-        cigar_from_string(region_q, region_m, region_s, strict_m=True)
-
-
-def _qms_to_matches(query, match, subject, strict_m=True):
-    matchline = []
-
-    for (q, m, s) in zip(query, match, subject):
-        ret = ''
-
-        if m != ' ' or m == '+':
-            ret = '='
-        elif m == ' ':
-            if q == '-':
-                ret = 'D'
-            elif s == '-':
-                ret = 'I'
-            else:
-                ret = 'X'
-        else:
-            log.warn("Bad data: \n\t%s\n\t%s\n\t%s\n" % (query, match, subject))
-
-        if strict_m:
-            if ret == '=' or ret == 'X':
-                ret = 'M'
-
-        matchline.append(ret)
-    return matchline
-
-
-def _matchline_to_cigar(matchline):
-    cigar_line = []
-    last_char = matchline[0]
-    count = 0
-    for char in matchline:
-        if char == last_char:
-            count += 1
-        else:
-            cigar_line.append("%s%s" % (last_char, count))
-            count = 1
-        last_char = char
-    cigar_line.append("%s%s" % (last_char, count))
-    return ' '.join(cigar_line)
-
-
-def cigar_from_string(query, match, subject, strict_m=True):
-    matchline = _qms_to_matches(query, match, subject, strict_m=strict_m)
-    if len(matchline) > 0:
-        return _matchline_to_cigar(matchline)
-    else:
-        return ""
-
-
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Convert Blast XML to gapped GFF3', epilog='')
     parser.add_argument('blastxml', type=argparse.FileType("r"), help='Blast XML Output')
@@ -1,27 +1,60 @@
 #!/usr/bin/env python
 import argparse
 import logging
+import sys
+from blasttab import read_blast, dice, TopK
 logging.basicConfig(level=logging.INFO)
 
+RANK_COLUMNS = {
+    'evalue': ('evalue',),
+    'bitscore': ('bitscore',),
+    'dice': ('nident', 'qlen', 'slen'),
+}
 
-def filter_blast(blast_results, top_n=5):
-    id_counts = {}
-    for line in blast_results:
-        # evalue = line.split('\t')[10]
-        id = line.split('\t')[0]
-        if id in id_counts:
-            id_counts[id] += 1
-        else:
-            id_counts[id] = 1
 
-        if id_counts[id] <= top_n:
-            print line
+def hit_scores(chunk, rank_by):
+    """Score of every hit in a chunk, higher is better"""
+    if rank_by == 'evalue':
+        return -chunk['evalue']
+    elif rank_by == 'bitscore':
+        return chunk['bitscore']
+    return dice(chunk)
+
+
+def filter_blast(blast_results, top_n=5, rank_by='order'):
+    if rank_by == 'order':
+        id_counts = {}
+        for chunk in read_blast(blast_results, columns=('qseqid',), lines=True):
+            for (line, id) in zip(chunk['_line'], chunk['qseqid']):
+                if id in id_counts:
+                    id_counts[id] += 1
+                else:
+                    id_counts[id] = 1
+
+                if id_counts[id] <= top_n:
+                    sys.stdout.write(line)
+        return
+
+    # Best top_n hits per query, grouped by query in the order they're first
+    # seen.
+    ranking = TopK(top_n)
+    columns = ('qseqid',) + RANK_COLUMNS[rank_by]
+    for chunk in read_blast(blast_results, columns=columns, lines=True):
+        scores = hit_scores(chunk, rank_by)
+        for (line, id, score) in zip(chunk['_line'], chunk['qseqid'], scores):
+            ranking.add(id, float(score), line)
+
+    for id in ranking.keys():
+        for line in ranking.top(id):
+            sys.stdout.write(line)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Filter blast results')
     parser.add_argument('blast_results', type=argparse.FileType("r"), help='Tabular Blast Results')
     parser.add_argument('top_n', type=int, help='Top N hits')
+    parser.add_argument('--rank_by', choices=['order', 'evalue', 'bitscore', 'dice'], default='order',
+                        help='Keep the first N hits per query as they appear in the file, or the N best by this score')
 
     args = parser.parse_args()
     filter_blast(**vars(args))
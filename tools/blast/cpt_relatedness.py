@@ -1,8 +1,10 @@
 #!/usr/bin/env python
+import heapq
 import numpy
 import argparse
 import re
 from kyotocabinet import DB
+from blasttab import read_rows
 import logging
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger()
@@ -29,13 +31,11 @@ def __load_blast_data(blast):
 
     hits = {}
     gi_num = re.compile('gi\|([0-9]+)')
-    for line in blast:
-        split_line = line.split('\t')
-
+    for (evalue, sallseqid) in read_rows(blast, columns=('evalue', 'sallseqid')):
         # Important data
-        evalue = float(split_line[10])
+        evalue = float(evalue)
 
-        gi_nums = gi_num.findall(split_line[12])
+        gi_nums = gi_num.findall(sallseqid)
         genome_ids = [db.get(x) for x in gi_nums if db.get(x) is not None]
 
         # Thanks to Peter's parser, the gi list and org list are the same
@@ -50,7 +50,7 @@ def __load_blast_data(blast):
     return hits
 
 
-def top_related(blast, report=None):
+def top_related(blast, report=None, top=10):
     # hits = Table of hits
     hits = __load_blast_data(blast)
 
@@ -63,8 +63,7 @@ def top_related(blast, report=None):
 
     # Top results
     top_accessions = {}
-    for key, value in list(reversed(sorted(hits.iteritems(), key=lambda (k, v):
-                                           (v, k))))[0:10]:
+    for key, value in heapq.nlargest(top, hits.iteritems(), key=lambda (k, v): (v, k)):
 
         top_accessions[key] = value
 
@@ -85,6 +84,7 @@ def top_related(blast, report=None):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Top related genomes')
     parser.add_argument('blast', type=argparse.FileType("r"), help='Blast 25 Column Results')
+    parser.add_argument('--top', type=int, help='Number of related genomes to report', default=10)
 
     args = parser.parse_args()
     top_related(**vars(args))
@@ -0,0 +1,120 @@
+"""
+Split gapped BLAST alignments into ``match_part``s with Gap CIGAR strings,
+shared by the blast to gapped GFF3 converters.
+"""
+import numpy
+
+GAP = ord('-')
+SPACE = ord(' ')
+
+
+def _as_array(seq):
+    if not isinstance(seq, bytes):
+        seq = seq.encode('ascii')
+    return numpy.frombuffer(seq, dtype=numpy.uint8)
+
+
+def _remove_query_gaps(query, match, subject):
+    """remove positions in all three based on gaps in query
+
+    In order to simplify math and calculations...we remove all of the gaps
+    based on gap locations in the query sequence::
+
+        Q:ACTG-ACTGACTG
+        S:ACTGAAC---CTG
+
+    will become::
+
+        Q:ACTGACTGACTG
+        S:ACTGAC---CTG
+
+    which greatly simplifies the process of identifying the correct location
+    for a match_part
+
+    The sequences are returned as byte arrays, cut to the shortest of the
+    three. match may be None.
+    """
+    lengths = [len(query), len(subject)]
+    if match is not None:
+        lengths.append(len(match))
+    length = min(lengths)
+
+    query = _as_array(query[:length])
+    keep = query != GAP
+    subject = _as_array(subject[:length])[keep]
+    if match is not None:
+        match = _as_array(match[:length])[keep]
+    return query[keep], match, subject
+
+
+class _Cigar(object):
+    """Run length encoding of an alignment's operations, sliced per part.
+
+    Columns with a match are M, as are mismatches. Columns without a match
+    where the subject has a gap are I. With no match line, every column is
+    M.
+    """
+
+    def __init__(self, match, subject):
+        if match is None:
+            self.ops = numpy.zeros(len(subject), dtype=bool)
+        else:
+            self.ops = (match == SPACE) & (subject == GAP)
+        # Positions where one run ends and the next begins
+        self.changes = numpy.flatnonzero(self.ops[1:] != self.ops[:-1]) + 1
+
+    def __call__(self, start, end):
+        """Gap attribute for the columns [start, end)"""
+        if end <= start:
+            return ""
+        lo = numpy.searchsorted(self.changes, start, side='right')
+        hi = numpy.searchsorted(self.changes, end, side='left')
+        bounds = numpy.concatenate(([start], self.changes[lo:hi], [end]))
+        return ' '.join(
+            '%s%s' % ('I' if self.ops[a] else 'M', b - a)
+            for (a, b) in zip(bounds[:-1], bounds[1:])
+        )
+
+
+def generate_parts(query, match, subject, ignore_under=3):
+    """Yield (start, end, Gap) for each part of an alignment.
+
+    Query gaps are removed first, and start/end count columns of what is
+    left. A column matches if the match line has anything but a space there
+    (or, with no match line, if query and subject agree). A part is a run of
+    columns from one match to another that contains no run of ignore_under
+    or more non-matching columns. Each part's Gap covers its columns.
+
+    The final yield is special: it is always made, and its Gap runs to the
+    end of the alignment rather than its last match. If the alignment ends
+    in ignore_under or more non-matching columns (or has no matches at
+    all), it is (-1, 0, Gap of the columns after them).
+    """
+    ignore_under = max(ignore_under, 1)
+    (query, match, subject) = _remove_query_gaps(query, match, subject)
+    length = len(query)
+
+    if match is None:
+        matched = numpy.flatnonzero(query == subject)
+    else:
+        matched = numpy.flatnonzero(match != SPACE)
+
+    cigar = _Cigar(match, subject)
+    if len(matched) == 0:
+        yield -1, 0, cigar(0, length)
+        return
+
+    # Split wherever consecutive matches are too far apart.
+    split = numpy.flatnonzero(numpy.diff(matched) > ignore_under)
+    starts = matched[numpy.concatenate(([0], split + 1))]
+    ends = matched[numpy.concatenate((split, [len(matched) - 1]))] + 1
+
+    for (start, end) in zip(starts[:-1], ends[:-1]):
+        yield int(start), int(end), cigar(start, end)
+
+    start, end = int(starts[-1]), int(ends[-1])
+    if length - end >= ignore_under:
+        yield start, end, cigar(start, end)
+        yield -1, 0, cigar(end + ignore_under, length)
+    else:
+        yield start, end, cigar(start, length)
@@ -1,27 +1,32 @@
 #!/usr/bin/env python
 import sys
+import heapq
 import argparse
 import json
+import numpy
 import logging
+import blasttab
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger()
 
 
-def parse_blast(blast):
-    for line in blast:
-        yield line.strip('\n').split('\t')
+def parse_blast(blast, split_identifiers, threshold=0.0):
+    """Query ID, e-value, organisms and dice of every hit with a dice score
+    above threshold.
 
-
-def with_dice(blast):
-    for data in blast:
-        dice = 2 * int(data[14]) / (float(data[22]) + float(data[23]))
-        yield data + [dice]
-
-
-def filter_dice(blast, threshold=0.5):
-    for data in blast:
-        if data[-1] > threshold:
-            yield data
+    Hits are read a chunk at a time, only reading the columns needed here,
+    and the dice filter is applied to the whole chunk at once.
+    """
+    columns = ('qseqid', 'sseqid', 'evalue', 'nident', 'qlen', 'slen', 'salltitles')
+    for chunk in blasttab.read_blast(blast, columns=columns):
+        scores = blasttab.dice(chunk)
+        for idx in numpy.flatnonzero(scores > threshold):
+            yield [
+                chunk['qseqid'][idx],
+                chunk['evalue'][idx],
+                split_identifiers(chunk['sseqid'][idx], chunk['salltitles'][idx]),
+                float(scores[idx]),
+            ]
 
 
 def split_identifiers_nucl(_, ident):
@@ -51,38 +56,6 @@ def split_identifiers_phage(par, ident):
     return [par]
 
 
-def important_only(blast, split_identifiers):
-    for data in blast:
-        yield [
-            data[0],  # 01 Query Seq-id (ID of your sequence)
-            # 02 Subject Seq-id (ID of the database hit)
-            # 03 Percentage of identical matches
-            # 04 Alignment length
-            # 05 Number of mismatches
-            # 06 Number of gap openings
-            # 07 Start of alignment in query
-            # 08 End of alignment in query
-            # 09 Start of alignment in subject (database hit)
-            # 10 End of alignment in subject (database hit)
-            data[10],  # 11 Expectation value (E-value)
-            # 12 Bit score
-            # 13 All subject Seq-id(s), separated by a ';'
-            # 14 Raw score
-            # 15 Number of identical matches
-            # 16 Number of positive-scoring matches
-            # 17 Total number of gaps
-            # 18 Percentage of positive-scoring matches
-            # 19 Query frame
-            # 20 Subject frame
-            # 21 Aligned part of query sequence
-            # 22 Aligned part of subject sequence
-            # 23 Query sequence length
-            # 24 Subject sequence length
-            split_identifiers(data[1], data[24]),  # 25 All subject title(s), separated by a '<>'
-            data[25]  # 26 dice
-        ]
-
-
 def deform_scores(blast):
     for data in blast:
         for org in data[2]:
@@ -140,6 +113,7 @@ if __name__ == '__main__':
     parser.add_argument('phagedb', type=argparse.FileType("r"))
     parser.add_argument('--protein', action='store_true')
     parser.add_argument('--canonical', action='store_true')
+    parser.add_argument('--top', type=int, help='Number of related genomes to report', default=5)
 
     args = parser.parse_args()
 
@@ -154,10 +128,7 @@ if __name__ == '__main__':
         splitId = split_identifiers_nucl
         phageNameLookup = {k['desc'].rstrip('.'): k['id'] for k in phageDb}
 
-    data = parse_blast(args.blast)
-    data = with_dice(data)
-    data = filter_dice(data, threshold=0.0)
-    data = important_only(data, splitId)
+    data = parse_blast(args.blast, splitId, threshold=0.0)
     data = deform_scores(data)
     data = filter_phage(data, phageNameLookup)
     if args.protein or args.canonical:
@@ -168,8 +139,5 @@ if __name__ == '__main__':
 
     scores, counts = scoreMap(data)
     sys.stdout.write('# ID\tName\tScore\t%s\n' % count_label)
-    for idx, ((name, pid), score) in enumerate(sorted(scores.items(), key=lambda (x, y): -y)):
-        if idx > 4:
-            break
-
+    for ((name, pid), score) in heapq.nlargest(args.top, scores.items(), key=lambda (x, y): y):
         sys.stdout.write('%s\t%s\t%05.3f\t%d\n' % (pid, name, score, counts[(name, pid)]))
@@ -1,21 +1,19 @@
 #!/usr/bin/env python
 import argparse
+from blasttab import read_blast
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='split blast results by organism')
     parser.add_argument('blast', type=argparse.FileType("r"))
     args = parser.parse_args()
 
-    blast = [
-        x.split('\t')
-        for x in args.blast.readlines()
-    ]
-
-    for row in blast:
-        if '<>' in row[24]:
-            for i in row[24].strip().split('<>'):
-                row_copy = row
-                row_copy[24] = i
-                print '\t'.join(row_copy).strip()
-        else:
-            print '\t'.join(row).strip()
+    for chunk in read_blast(args.blast, columns=('salltitles',), lines=True):
+        for (line, titles) in zip(chunk['_line'], chunk['salltitles']):
+            if '<>' in titles:
+                # Only rows with several titles need splitting up
+                row = line.split('\t')
+                for i in row[24].strip().split('<>'):
+                    row[24] = i
+                    print '\t'.join(row).strip()
+            else:
+                print line.strip()
@@ -1,64 +1,64 @@
 #!/usr/bin/env python
 import argparse
-import copy
 import logging
+import numpy
 import xmfa
-from itertools import groupby
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 
-def split_lcb(lcb, window_size=10, threshold=0.7):
-    # Transpose sequence
-    lines = []
-    max_align_num = len(lcb[0]['seq'])
-    for i in range(max_align_num):
-        lines.append([])
-        for j in range(len(lcb)):
-            c = lcb[j]['seq'][i]
-            if c != '-':
-                lines[i].append(j)
+def window_occupancy(lcb, window_size=10):
+    """Number of non gap columns of each member in each window of an LCB
+
+    Returns a (members x windows) array. Columns are counted up to the
+    length of the first member's sequence. The last window may be short,
+    and members shorter than the first are treated as gaps past their end.
+    """
+    columns = len(lcb[0]['seq'])
+    windows = -(-columns // window_size)
+    occupied = numpy.zeros((len(lcb), windows * window_size), dtype=bool)
+    for j, member in enumerate(lcb):
+        row = numpy.frombuffer(member['seq'][:columns], dtype=numpy.uint8)
+        occupied[j, :len(row)] = row != ord('-')
+    return occupied.reshape(len(lcb), windows, window_size).sum(axis=2)
 
-    count_groups = []
-    for i in range(0, len(lines), window_size):
-        current_lines = lines[i:i + window_size]
-        flat_list = [a for b in current_lines for a in b]
-        counts = []
-        for i in range(len(lcb)):
-            value = float(flat_list.count(i)) / window_size
-            if value >= threshold:
-                counts.append(i)
-        count_groups.append(counts)
 
-    # groups = [(next(j), len(list(j)) + 1) for i, j in ]
+def split_lcb(lcb, window_size=10, threshold=0.7):
+    # Which members occupy at least threshold of each window
+    present = window_occupancy(lcb, window_size) / float(window_size) >= threshold
+    windows = present.shape[1]
+    if windows == 0:
+        return []
+
+    # Run length encode the windows' membership, e.g.
     # [([4], 2), ([2, 3, 4, 5, 6], 2), ([0, 1, 2, 3, 4, 5, 6], 14), ([0, 3], 1)]
     # This says for 2 window sizes, we emit a new LCB with just [0:10] and
     # [10:20] for lcb #4, then one with all but 0/1 for 2, then all for 14.
+    changes = numpy.flatnonzero((present[:, 1:] != present[:, :-1]).any(axis=0)) + 1
+    starts = numpy.concatenate(([0], changes))
+    ends = numpy.concatenate((changes, [windows]))
+
     new_lcbs = []
-    position = 0
-    for i, j in groupby(count_groups):
-        tmp = list(j)
-        count = len(tmp)
-        members = tmp[0]
+    for (position, end) in zip(starts, ends):
+        position, count = int(position), int(end - position)
         local_members = []
-        for member in members:
-            tmp_member = copy.deepcopy(lcb[member])
+        for member in numpy.flatnonzero(present[:, position]):
+            # Every value is immutable, a shallow copy is enough
+            tmp_member = dict(lcb[member])
             tmp_member['seq'] = tmp_member['seq'][window_size * position:window_size * (position + count)]
             tmp_member['start'] = tmp_member['start'] + (3 * window_size * position)
             tmp_member['end'] = tmp_member['start'] + (3 * window_size * count)
             local_members.append(tmp_member)
         if len(local_members) > 0:
             new_lcbs.append(local_members)
-
-        position += count
     return new_lcbs
 
 
 def split_lcbs(lcbs, window_size=10, threshold=100):
-    new_lcbs = []
+    # Generator, so that an LCB at a time is read, split and written out.
     for lcb in lcbs:
-        new_lcbs.extend(split_lcb(lcb, window_size=window_size, threshold=threshold))
-    return new_lcbs
+        for new_lcb in split_lcb(lcb, window_size=window_size, threshold=threshold):
+            yield new_lcb
 
 
 if __name__ == '__main__':
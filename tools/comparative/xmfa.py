@@ -26,49 +26,163 @@
 # OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 from Bio import SeqIO
 import tempfile
+import argparse
+import mmap
+import stat
 import sys
+import os
 
+# Sidecar LCB index of an XMFA file, see write_xmfa_index
+INDEX_SUFFIX = '.lcbidx'
 
-def parse_xmfa(xmfa):
-    """Simple XMFA parser until https://github.com/biopython/biopython/pull/544
+
+def _parse_header(line):
+    data = line.strip().split()
+    # 0 1           2 3      4 5
+    # > 1:5986-6406 + CbK.fa # CbK_gp011
+    id, loc = data[1].split(':')
+    start, end = loc.split('-')
+    entry = {
+        'rid': '_'.join(data[1:]),
+        'id': id,
+        'start': int(start),
+        'end': int(end),
+        'strand': 1 if data[2] == '+' else -1,
+        'file': data[3],
+        'comment': '',
+    }
+    if len(data) > 5:
+        entry['comment'] = ' '.join(data[5:])
+    return entry
+
+
+def _scan_xmfa(xmfa, sequences=True):
+    """Walk an XMFA file one LCB at a time.
+
+    Yields (byte offset, byte length, lcb) for each LCB, so only a single
+    LCB is ever held in memory. The sequence lines of an entry are collected
+    and joined once at the end of it. With sequences=False they are skipped
+    entirely and entries have no 'seq' (and keep their header line in
+    'header' instead).
     """
+    offset = 0
+    lcb_offset = 0
     current_lcb = []
-    current_seq = {}
-    for line in xmfa.readlines():
+    current_seq = None
+    seq_lines = []
+    # Iterating over the handle reads it in buffered blocks, rather than
+    # pulling the whole file into memory with readlines()
+    for line in xmfa:
+        offset += len(line)
         if line.startswith('#'):
             continue
 
-        if line.strip() == '=':
-            if 'id' in current_seq:
+        line = line.strip()
+        if line == '=' or line.startswith('>'):
+            if current_seq is not None:
+                if sequences:
+                    current_seq['seq'] = ''.join(seq_lines)
                 current_lcb.append(current_seq)
-                current_seq = {}
-            yield current_lcb
-            current_lcb = []
-        else:
-            line = line.strip()
-            if line.startswith('>'):
-                if 'id' in current_seq:
-                    current_lcb.append(current_seq)
-                    current_seq = {}
-                data = line.strip().split()
-                # 0 1           2 3      4 5
-                # > 1:5986-6406 + CbK.fa # CbK_gp011
-                id, loc = data[1].split(':')
-                start, end = loc.split('-')
-                current_seq = {
-                    'rid': '_'.join(data[1:]),
-                    'id': id,
-                    'start': int(start),
-                    'end': int(end),
-                    'strand': 1 if data[2] == '+' else -1,
-                    'file': data[3],
-                    'seq': '',
-                    'comment': '',
-                }
-                if len(data) > 5:
-                    current_seq['comment'] = ' '.join(data[5:])
+                current_seq = None
+
+            if line == '=':
+                yield lcb_offset, offset - lcb_offset, current_lcb
+                current_lcb = []
+                lcb_offset = offset
             else:
-                current_seq['seq'] += line.strip()
+                current_seq = _parse_header(line)
+                if not sequences:
+                    current_seq['header'] = line
+                seq_lines = []
+        elif sequences:
+            seq_lines.append(line)
+
+
+def parse_xmfa(xmfa):
+    """Simple XMFA parser until https://github.com/biopython/biopython/pull/544
+    """
+    for (offset, length, lcb) in _scan_xmfa(xmfa):
+        yield lcb
+
+
+class IndexedLcb(list):
+    """The entries of an LCB, without their sequences, and the location of
+    the LCB in the XMFA file."""
+
+    def __init__(self, entries, offset, length):
+        super(IndexedLcb, self).__init__(entries)
+        self.offset = offset
+        self.length = length
+
+
+def index_xmfa(xmfa):
+    """IndexedLcb for every LCB of an XMFA file, in one pass over it"""
+    return [
+        IndexedLcb(lcb, offset, length)
+        for (offset, length, lcb) in _scan_xmfa(xmfa, sequences=False)
+    ]
+
+
+def write_xmfa_index(index, handle):
+    """Write an index as one tab separated line per LCB: the byte offset and
+    byte length of the LCB, then the header line of each entry."""
+    for lcb in index:
+        fields = [str(lcb.offset), str(lcb.length)]
+        fields.extend(' '.join(entry['header'].split()) for entry in lcb)
+        handle.write('\t'.join(fields) + '\n')
+
+
+def read_xmfa_index(handle):
+    index = []
+    for line in handle:
+        data = line.rstrip('\n').split('\t')
+        entries = []
+        for header in data[2:]:
+            entry = _parse_header(header)
+            entry['header'] = header
+            entries.append(entry)
+        index.append(IndexedLcb(entries, int(data[0]), int(data[1])))
+    return index
+
+
+def is_indexable(xmfa):
+    """Whether an open XMFA file is a regular file, which can be indexed and
+    mapped. Pipes (and e.g. /dev/stdin) can only be read once, in order, with
+    parse_xmfa."""
+    try:
+        return stat.S_ISREG(os.fstat(xmfa.fileno()).st_mode)
+    except (AttributeError, ValueError, OSError):
+        return False
+
+
+def xmfa_index(xmfa):
+    """Index of an open XMFA file, which must be a regular file (see
+    is_indexable).
+
+    This is read from the sidecar index (the file name plus INDEX_SUFFIX) if
+    there is one at least as new as the XMFA file, otherwise the file is
+    indexed from the handle.
+    """
+    sidecar = xmfa.name + INDEX_SUFFIX
+    if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(xmfa.name):
+        with open(sidecar, 'r') as handle:
+            return read_xmfa_index(handle)
+    return index_xmfa(xmfa)
+
+
+def mmap_xmfa(xmfa):
+    """Read only memory map of an open XMFA file, for load_lcb"""
+    if os.fstat(xmfa.fileno()).st_size == 0:
+        # Can't map an empty file, but nor will there be any LCBs to load.
+        return ''
+    return mmap.mmap(xmfa.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def load_lcb(mapped, lcb):
+    """Parse the single LCB an IndexedLcb points to out of a mapped XMFA
+    file."""
+    block = mapped[lcb.offset:lcb.offset + lcb.length]
+    return next(parse_xmfa(block.splitlines(True)))
 
 
 HEADER_TPL = '> {id}:{start}-{end} {strand} {file} # {comment}\n'
@@ -77,9 +191,8 @@ HEADER_TPL = '> {id}:{start}-{end} {strand} {file} # {comment}\n'
 def split_by_n(seq, n):
     """A generator to divide a sequence into chunks of n units."""
     # http://stackoverflow.com/questions/9475241/split-python-string-every-nth-character
-    while seq:
-        yield seq[:n]
-        seq = seq[n:]
+    for i in range(0, len(seq), n):
+        yield seq[i:i + n]
 
 
 def to_xmfa(lcbs, handle=sys.stdout):
@@ -143,3 +256,16 @@ def id_tn_dict(sequences, tmpfile=False):
                 label_convert[key] = tempfile.NamedTemporaryFile(delete=False)
 
     return label_convert
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a sidecar LCB index for an XMFA file')
+    parser.add_argument('xmfa', help='XMFA file, the index is written to this name plus ' + INDEX_SUFFIX)
+    args = parser.parse_args()
+
+    with open(args.xmfa, 'r') as handle:
+        if not is_indexable(handle):
+            parser.error('%s is not a regular file, so it cannot be indexed' % args.xmfa)
+        index = index_xmfa(handle)
+    with open(args.xmfa + INDEX_SUFFIX, 'w') as handle:
+        write_xmfa_index(index, handle)
@@ -5,8 +5,9 @@ import subprocess
 import re
 import sys
 import tempfile
+import numpy
 from Bio import SeqIO
-from xmfa import parse_xmfa, percent_identity
+from xmfa import parse_xmfa
 
 
 def secure_filename(filename):
@@ -67,49 +68,84 @@ def _id_tn_dict(sequences):
 
         label_convert[str(i + 1)] = {'record_id': record.id,
                                      'len': len(record.seq),
-                                     'temp': tempfile.NamedTemporaryFile(delete=False)}
-
-        label_convert[str(i + 1)]['temp'].write("variableStep chrom=%s\n" % (correct_chrom or record.id, ))
+                                     'chrom': correct_chrom,
+                                     'track': None}
     return label_convert
 
 
-def convert_to_bigwig(wig_file, chr_sizes, bw_file):
+def convert_to_bigwig(bedgraph_file, chr_sizes, bw_file):
     # This will be fine under Galaxy, but could use temp folder?
     size_file = "%s-sizes.txt" % (os.path.splitext(bw_file)[0])
     with open(size_file, "w") as out_handle:
         for chrom, size in chr_sizes:
             out_handle.write("%s\t%s\n" % (chrom, size))
     try:
-        cl = ["wigToBigWig", wig_file, size_file, bw_file]
+        cl = ["bedGraphToBigWig", bedgraph_file, size_file, bw_file]
         print ' '.join(cl)
         subprocess.check_call(cl)
     finally:
         pass
-        os.remove(wig_file)
+        os.remove(bedgraph_file)
         os.remove(size_file)
     return bw_file
 
 
+def encode(seq):
+    """Alignment row as a uint8 array, one element per column"""
+    return numpy.frombuffer(seq, dtype=numpy.uint8)
+
+
 def remove_gaps(parent, others):
-    # one or more dashes
-    m = re.compile('-+')
-    fixed_parent = ""
-    fixed_others = ["" for x in others]
+    """Drop the columns where the (encoded) parent has a gap.
 
-    last_gap_idx = 0
-    # Body
-    for gap in m.finditer(parent):
-        fixed_parent += parent[last_gap_idx:gap.start()]
-        for i, other in enumerate(others):
-            fixed_others[i] += other[last_gap_idx:gap.start()]
-        last_gap_idx = gap.end()
+    Rows needn't be as long as the parent. Each is cut to the parent's
+    length, and one that is shorter keeps only the columns it has, so it
+    may end up shorter than the gap free parent (but still aligned with it).
+    """
+    keep = parent != ord('-')
+    return parent[keep], [other[:len(parent)][keep[:len(other)]] for other in others]
 
-    # Tail
-    fixed_parent += parent[last_gap_idx:]
-    for i, other in enumerate(others):
-        fixed_others[i] += other[last_gap_idx:]
 
-    return fixed_parent, fixed_others
+def window_identity(parent, other, window_size):
+    """Percent identity of other against a gap free parent, in a window of
+    [i - window_size, i + window_size) around every column i except the
+    first and last.
+
+    The match mask is computed once, and each window's match count is a
+    difference of its cumulative sum. Where other is shorter than the
+    parent, windows only count the columns it has, and a window with none
+    of them has an identity of 0.
+    """
+    matches = numpy.concatenate(([0], numpy.cumsum(parent[:len(other)] == other)))
+    columns = numpy.arange(1, len(parent) - 1)
+    left = numpy.minimum(numpy.maximum(0, columns - window_size), len(other))
+    right = numpy.minimum(len(other), columns + window_size)
+    compared = numpy.maximum(right - left, 0)
+    identity = numpy.zeros(len(columns))
+    counted = compared > 0
+    identity[counted] = 100 * (matches[right[counted]] - matches[left[counted]]).astype(float) / compared[counted]
+    return columns, identity
+
+
+def to_runs(track):
+    """(starts, ends, values) of the runs of equal values in a per base
+    track, skipping bases with no value (NaN)."""
+    if len(track) == 0:
+        empty = numpy.array([], dtype=numpy.int64)
+        return empty, empty, track
+    valid = ~numpy.isnan(track)
+    # NaN != NaN, so every unset base starts a new (dropped) run
+    breaks = numpy.flatnonzero((track[1:] != track[:-1]) | (valid[1:] != valid[:-1])) + 1
+    starts = numpy.concatenate(([0], breaks))
+    ends = numpy.concatenate((breaks, [len(track)]))
+    keep = valid[starts]
+    return starts[keep], ends[keep], track[starts[keep]]
+
+
+def write_bedgraph(handle, chrom, track):
+    """Write a per base track as bedGraph, one line per run of equal values"""
+    for (start, end, value) in zip(*to_runs(track)):
+        handle.write("%s\t%s\t%s\t%s\n" % (chrom, start, end, float(value)))
 
 
 def convert_xmfa_to_gff3(xmfa_file, fasta_genomes, window_size=3, relative_to='1'):
@@ -136,26 +172,21 @@ def convert_xmfa_to_gff3(xmfa_file, fasta_genomes, window_size=3, relative_to='1
         if parent['start'] == 0 and parent['end'] == 0:
             continue
 
-        corrected_parent, corrected_targets = remove_gaps(parent['seq'],
-                                                          [other['seq'] for other in others])
-        # Update the parent/others with corrected sequences
-        parent['corrected'] = corrected_parent
-        for i, target in enumerate(corrected_targets):
-            others[i]['corrected'] = target
-
-        for i in range(1, len(corrected_parent) - 1):
-            for other in others:
-                left_bound = max(0, i - window_size)
-                right_bound = i + window_size
-                point_pid = percent_identity(
-                    parent['corrected'][left_bound:right_bound],
-                    other['corrected'][left_bound:right_bound]
-                )
-
-                label_convert[other['id']]['temp'].write("%s\t%s\n" % (
-                    abs(parent['start']) + i,
-                    point_pid
-                ))
+        corrected_parent, corrected_targets = remove_gaps(encode(parent['seq']),
+                                                          [encode(other['seq']) for other in others])
+
+        parent_length = label_convert[relative_to]['len']
+        for (other, target) in zip(others, corrected_targets):
+            columns, point_pid = window_identity(corrected_parent, target, window_size)
+            # Column i is (1 based) base parent start + i, i.e. index
+            # parent start + i - 1 of the track. Later LCBs overwrite
+            # earlier ones where they overlap.
+            positions = columns + abs(parent['start']) - 1
+            on_genome = positions < parent_length
+
+            if label_convert[other['id']]['track'] is None:
+                label_convert[other['id']]['track'] = numpy.full(parent_length, numpy.nan)
+            label_convert[other['id']]['track'][positions[on_genome]] = point_pid[on_genome]
 
     for key in label_convert.keys():
         # Ignore self-self
@@ -163,11 +194,15 @@ def convert_xmfa_to_gff3(xmfa_file, fasta_genomes, window_size=3, relative_to='1
             continue
 
         other = label_convert[key]
-        other['temp'].close()
+        bedgraph = tempfile.NamedTemporaryFile(delete=False)
+        if other['track'] is not None:
+            write_bedgraph(bedgraph, other['chrom'], other['track'])
+        bedgraph.close()
+
         sizes = [(label_convert[relative_to]['record_id'], label_convert[relative_to]['len'])]
         bw_file = os.path.join("out", secure_filename(other['record_id'] + '.bigwig'))
 
-        convert_to_bigwig(label_convert[key]['temp'].name, sizes, bw_file)
+        convert_to_bigwig(bedgraph.name, sizes, bw_file)
 
 
 if __name__ == '__main__':
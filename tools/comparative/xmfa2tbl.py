@@ -1,10 +1,10 @@
 #!/usr/bin/env python
 from Bio import SeqIO
 import sys
-from xmfa import parse_xmfa, percent_identity
+import numpy
+from xmfa import parse_xmfa
 import argparse
 import logging
-import itertools
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
@@ -26,66 +26,81 @@ def _id_tn_dict(sequences):
     return label_convert
 
 
+def encode_alignment(seqs):
+    """Aligned sequences as the rows of a 2-D uint8 array, padded with zeros
+    to the longest"""
+    encoded = numpy.zeros((len(seqs), max(len(seq) for seq in seqs)), dtype=numpy.uint8)
+    for i, seq in enumerate(seqs):
+        encoded[i, :len(seq)] = numpy.frombuffer(seq, dtype=numpy.uint8)
+    return encoded
+
+
+def identity_matrix(seqs):
+    """xmfa.percent_identity(seqs[i], seqs[j]) for every pair of sequences
+
+    Matching columns are symmetric, so they're counted once for all pairs
+    with a matrix product per symbol. Only the denominator, the non gap
+    columns of seqs[i] (up to the end of the shorter sequence), depends on
+    the order of the pair.
+    """
+    encoded = encode_alignment(seqs)
+    present = encoded != 0
+    residue = present & (encoded != ord('-'))
+
+    matches = numpy.zeros((len(seqs), len(seqs)))
+    for symbol in numpy.unique(encoded[residue]):
+        is_symbol = (encoded == symbol).astype(numpy.float64)
+        matches += numpy.dot(is_symbol, is_symbol.T)
+    compared = numpy.dot(residue.astype(numpy.float64), present.T.astype(numpy.float64))
+
+    identity = numpy.zeros_like(matches)
+    numpy.divide(100 * matches, compared, out=identity, where=compared > 0)
+    return identity
+
+
 def total_similarity(xmfa_file, sequences=None, dice=False):
     if sequences is None:
         raise Exception("Must provide a non-zero number of sequence files")
 
     label_convert = _id_tn_dict(sequences)
-    lcbs = parse_xmfa(xmfa_file)
-
-    # make a matrix based on number of sequences
-    table = {}
-
-    for lcb in lcbs:
-        # ignore LCBs containing only one sequence
-        if len(lcb) == 0:
+    table_keys = sorted(label_convert.keys())
+    names = [label_convert[i]['id'] for i in table_keys]
+    index = {}
+    for idx, name in enumerate(names):
+        index.setdefault(name, idx)
+    lengths = numpy.array([label_convert[i]['len'] for i in table_keys], dtype=numpy.float64)
+
+    # similarity summed over LCBs, weighted by the length of the row
+    # sequence in each; table[i, j] compares names[i] against names[j]
+    table = numpy.zeros((len(names), len(names)))
+
+    for lcb in parse_xmfa(xmfa_file):
+        # LCBs containing only one sequence have nothing to compare
+        if len(lcb) < 2:
             continue
 
-        # permutations based on num sequences to compare for current LCB
-        compare_seqs = list(itertools.permutations(range(0, len(lcb)), 2))
-        for permutation in compare_seqs:
-            (i, j) = permutation
-            similarity = percent_identity(lcb[i]['seq'], lcb[j]['seq'])
-
-            i_name = label_convert[lcb[i]['id']]['id']
-            j_name = label_convert[lcb[j]['id']]['id']
-            # find length of sequence in LCB
-            length_seq_lcb = lcb[i]['end'] - (lcb[i]['start'] - 1)
-            # populate table with normalized similarity value based on length_seq_lcb
-            if (i_name, j_name) not in table:
-                table[(i_name, j_name)] = 0
-            table[(i_name, j_name)] += length_seq_lcb * similarity
+        similarity = identity_matrix([aln['seq'] for aln in lcb])
+        rows = numpy.array([index[label_convert[aln['id']]['id']] for aln in lcb])
+        # length of each sequence in the LCB
+        length_seq_lcb = numpy.array([aln['end'] - (aln['start'] - 1) for aln in lcb], dtype=numpy.float64)
 
-    # finalize total percent similarity by dividing by length of parent sequence
-    for i in label_convert.keys():
-        for j in label_convert.keys():
-            i_name = label_convert[i]['id']
-            j_name = label_convert[j]['id']
-            if (i_name, j_name) in table:
-                if dice:
-                    table[(i_name, j_name)] = 2 * table[(i_name, j_name)] / (label_convert[i]['len'] + label_convert[j]['len'])
-                else:
-                    table[(i_name, j_name)] = table[(i_name, j_name)] / label_convert[i]['len']
-            else:
-                table[(i_name, j_name)] = 0
-
-            if i_name == j_name:
-                table[(i_name, j_name)] = 100
-
-    # print table
-    names = []
-    table_keys = sorted(label_convert.keys())
+        weighted = length_seq_lcb[:, numpy.newaxis] * similarity
+        numpy.fill_diagonal(weighted, 0)
+        numpy.add.at(table, (rows[:, numpy.newaxis], rows[numpy.newaxis, :]), weighted)
 
-    for i in table_keys:
-        names.append(label_convert[i]['id'])
+    # finalize total percent similarity by dividing by length of parent sequence
+    if dice:
+        table = 2 * table / (lengths[:, numpy.newaxis] + lengths[numpy.newaxis, :])
+    else:
+        table = table / lengths[:, numpy.newaxis]
+    numpy.fill_diagonal(table, 100)
 
+    # print table, one row per genome, against each genome in the columns
     sys.stdout.write('\t' + '\t'.join(names) + '\n')
-    for j in table_keys:
-        j_key = label_convert[j]['id']
+    for j, j_key in enumerate(names):
         sys.stdout.write(j_key)
-        for i in table_keys:
-            i_key = label_convert[i]['id']
-            sys.stdout.write('\t%0.2f' % table[(i_key, j_key)])
+        for i in range(len(names)):
+            sys.stdout.write('\t%0.2f' % table[i, j])
         sys.stdout.write('\n')
 
 
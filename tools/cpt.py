@@ -1,8 +1,10 @@
 #!/usr/bin/env python
+import gzip
+import numpy
 import regex as re
-from Bio.Seq import Seq, reverse_complement, translate
-from Bio.SeqRecord import SeqRecord
+from Bio.Seq import reverse_complement, translate
 from Bio import SeqIO
+from Bio import bgzf
 from Bio.Data import CodonTable
 import logging
 logging.basicConfig()
@@ -45,6 +47,168 @@ def phage_name_parser(name):
     return (host, phage)
 
 
+# Base to 2-bit code, anything other than ACGT (N, IUPAC codes, U) is 4.
+_BASE_CODES = numpy.full(256, 4, dtype=numpy.uint8)
+for _code, _base in enumerate('ACGT'):
+    _BASE_CODES[ord(_base)] = _code
+
+
+class CodonScanner(object):
+    """Find start/stop delimited reading frames in all three frames at once.
+
+    The sequence is encoded once into an array of codon codes (one per
+    position, 0-63 for unambiguous codons), and start codons, stop codons and
+    amino acids are read out of 64 entry lookup tables. Each frame is then
+    translated exactly once; the protein for every start codon in a stop
+    delimited segment is a slice of that translation.
+
+    Codons containing anything other than ACGT are rare, and are checked
+    against the (ambiguous) start/stop codon lists and translated by
+    Biopython individually.
+    """
+
+    def __init__(self, table, start_codons, stop_codons):
+        self.table = table
+        self.start_codons = set(start_codons)
+        self.stop_codons = set(stop_codons)
+
+        codons = [a + b + c for a in 'ACGT' for b in 'ACGT' for c in 'ACGT']
+        self.start_table = numpy.array([c in self.start_codons for c in codons])
+        self.stop_table = numpy.array([c in self.stop_codons for c in codons])
+        self.amino_acid_table = numpy.array(list(translate(''.join(codons), table)), dtype='S1')
+
+    def encode(self, seq):
+        """Returns codon codes, and a mask of ambiguous codons, for every
+        position of seq where a full codon starts."""
+        bases = _BASE_CODES[numpy.frombuffer(bytearray(seq), dtype=numpy.uint8)]
+        first, second, third = bases[:-2], bases[1:-1], bases[2:]
+        ambiguous = (first > 3) | (second > 3) | (third > 3)
+        codes = (first.astype(numpy.int32) & 3) * 16 + (second & 3) * 4 + (third & 3)
+        return codes, ambiguous
+
+    def frames(self, seq, min_len, frames=(0, 1, 2)):
+        """Yields frame, offset, nucleotides, protein for every start codon
+        with an in frame stop codon downstream, where the protein (including
+        the stop) is at least min_len long.
+
+        Offsets are relative to the frame, i.e. seq[frame:], and results come
+        out ordered by frame then offset.
+        """
+        if len(seq) < 3:
+            return
+        codes, ambiguous = self.encode(seq)
+        is_start = self.start_table[codes]
+        is_stop = self.stop_table[codes]
+        for position in numpy.flatnonzero(ambiguous):
+            codon = seq[position:position + 3]
+            is_start[position] = codon in self.start_codons
+            is_stop[position] = codon in self.stop_codons
+        amino_acids = self.amino_acid_table[codes]
+
+        for frame in frames:
+            stops = numpy.flatnonzero(is_stop[frame::3])
+            if len(stops) == 0:
+                continue
+            starts = numpy.flatnonzero(is_start[frame::3])
+            frame_ambiguous = numpy.flatnonzero(ambiguous[frame::3])
+            protein = amino_acids[frame::3].tobytes()
+
+            # Each stop closes the segment following the previous stop, find
+            # the first start codon in each segment.
+            segment_starts = numpy.concatenate(([0], stops[:-1] + 1))
+            first_start = numpy.searchsorted(starts, segment_starts)
+            last_start = numpy.searchsorted(starts, stops, side='right')
+            for (stop, lo, hi) in zip(stops, first_start, last_start):
+                for codon_start in starts[lo:hi]:
+                    # Starts are ascending, so every later one is shorter.
+                    if stop - codon_start + 1 < min_len:
+                        break
+                    n = seq[frame + 3 * codon_start:frame + 3 * (stop + 1)]
+                    amb = numpy.searchsorted(frame_ambiguous, codon_start)
+                    if amb < len(frame_ambiguous) and frame_ambiguous[amb] <= stop:
+                        t = translate(n, self.table)
+                    else:
+                        t = protein[codon_start:stop + 1]
+                    yield frame, 3 * int(codon_start), n, t
+
+
+def fasta_entry(id, description, seq, wrap=60):
+    """A FASTA record, formatted as SeqIO.write would"""
+    lines = [">%s %s\n" % (id, description)]
+    for i in range(0, len(seq), wrap):
+        lines.append(seq[i:i + wrap] + "\n")
+    return ''.join(lines)
+
+
+def compressed_handle(handle, compression=None):
+    """Wrap an output handle for gzip or bgzip (blocked gzip) compression"""
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=handle, mode='wb')
+    elif compression == 'bgzip':
+        return bgzf.BgzfWriter(fileobj=handle)
+    return handle
+
+
+class OrfWriter(object):
+    """Write ORFs to nucleotide/protein FASTA, BED and GFF3 outputs.
+
+    Lines are formatted directly and buffered, and each output is written in
+    chunks of `chunk_size` ORFs, rather than going through two SeqRecords and
+    two SeqIO.write calls per ORF.
+    """
+
+    def __init__(self, out_nuc, out_prot, out_bed, out_gff3, ftype, compression=None, chunk_size=10000):
+        self.compression = compression
+        self.handles = [compressed_handle(x, compression) for x in (out_nuc, out_prot, out_bed, out_gff3)]
+        self.buffers = [[], [], [], []]
+        self.ftype = ftype
+        self.chunk_size = chunk_size
+        self.count = 0
+
+        self.handles[3].write('##gff-version 3\n')
+
+    def add(self, record, idx, i, f_start, f_end, f_strand, n, t):
+        """Add the i-th ORF of the idx-th record"""
+        descr = "length %i aa, %i bp, from %s..%s[%s] of %s" \
+                % (len(t), len(n), f_start, f_end, f_strand, record.description)
+        fid = record.id + "|%s%i" % (self.ftype, i + 1)
+        nice_strand = '+' if f_strand == +1 else '-'
+
+        (nuc, prot, bed, gff3) = self.buffers
+        nuc.append(fasta_entry(fid, descr, n))
+        prot.append(fasta_entry(fid, descr, t))
+        bed.append('\t'.join(map(str, [
+            record.id, f_start, f_end, fid, 0, nice_strand])) + '\n')
+        gff3.append('\t'.join(map(str, [
+            record.id, 'getOrfsOrCds', 'CDS', f_start + 1, f_end, '.',
+            nice_strand, 0, 'ID=%s.%s.%s' % (self.ftype, idx, i + 1)])) + '\n')
+
+        self.count += 1
+        if self.count % self.chunk_size == 0:
+            self.flush()
+
+    def flush(self):
+        for (handle, buf) in zip(self.handles, self.buffers):
+            if buf:
+                handle.write(''.join(buf))
+                del buf[:]
+
+    def close(self):
+        """Flush, and finish off any compressed streams"""
+        self.flush()
+        if self.compression is not None:
+            for handle in self.handles:
+                handle.close()
+
+    def write_all(self, finder, fasta_file, seq_format="fasta"):
+        """Run finder.get_all_peptides over every record in fasta_file"""
+        for idx, record in enumerate(SeqIO.parse(fasta_file, seq_format)):
+            for i, (f_start, f_end, f_strand, n, t) in enumerate(finder.get_all_peptides(str(record.seq).upper())):
+                self.add(record, idx, i, f_start, f_end, f_strand, n, t)
+        self.close()
+        return self.count
+
+
 class OrfFinder(object):
 
     def __init__(self, table, ftype, ends, min_len, strand):
@@ -55,73 +219,21 @@ class OrfFinder(object):
         self.min_len = min_len
         self.starts = sorted(self.table_obj.start_codons)
         self.stops = sorted(self.table_obj.stop_codons)
-        self.re_starts = re.compile("|".join(self.starts))
-        self.re_stops = re.compile("|".join(self.stops))
+        self.scanner = CodonScanner(table, self.starts, self.stops)
         self.strand = strand
 
-    def locate(self, fasta_file, out_nuc, out_prot, out_bed, out_gff3):
-        seq_format = "fasta"
+    def locate(self, fasta_file, out_nuc, out_prot, out_bed, out_gff3, compression=None):
         log.debug("Genetic code table %i" % self.table)
         log.debug("Minimum length %i aa" % self.min_len)
 
-        out_count = 0
-
-        out_gff3.write('##gff-version 3\n')
-
-        for idx, record in enumerate(SeqIO.parse(fasta_file, seq_format)):
-            for i, (f_start, f_end, f_strand, n, t) in enumerate(self.get_all_peptides(str(record.seq).upper())):
-                out_count += 1
-
-                descr = "length %i aa, %i bp, from %s..%s[%s] of %s" \
-                        % (len(t), len(n), f_start, f_end, f_strand, record.description)
-                fid = record.id + "|%s%i" % (self.ftype, i + 1)
-
-                r = SeqRecord(Seq(n), id=fid, name="", description=descr)
-                t = SeqRecord(Seq(t), id=fid, name="", description=descr)
-
-                SeqIO.write(r, out_nuc, "fasta")
-                SeqIO.write(t, out_prot, "fasta")
-
-                nice_strand = '+' if f_strand == +1 else '-'
-
-                out_bed.write('\t'.join(map(str, [
-                    record.id, f_start, f_end, fid, 0, nice_strand])) + '\n')
-
-                out_gff3.write('\t'.join(map(str, [
-                    record.id, 'getOrfsOrCds', 'CDS', f_start + 1, f_end, '.',
-                    nice_strand, 0, 'ID=%s.%s.%s' % (self.ftype, idx, i + 1)])) + '\n')
+        writer = OrfWriter(out_nuc, out_prot, out_bed, out_gff3, self.ftype, compression=compression)
+        out_count = writer.write_all(self, fasta_file)
         log.info("Found %i %ss", out_count, self.ftype)
 
-    def start_chop_and_trans(self, s, strict=True):
-        """Returns offset, trimmed nuc, protein."""
-        if strict:
-            assert s[-3:] in self.stops, s
-        assert len(s) % 3 == 0
-        for match in self.re_starts.finditer(s, overlapped=True):
-            # Must check the start is in frame
-            start = match.start()
-            if start % 3 == 0:
-                n = s[start:]
-                assert len(n) % 3 == 0, "%s is len %i" % (n, len(n))
-                if strict:
-                    t = translate(n, self.table)
-                else:
-                    # Use when missing stop codon,
-                    t = "M" + translate(n[3:], self.table, to_stop=True)
-                yield start, n, t
-
     def break_up_frame(self, s):
         """Returns offset, nuc, protein."""
-        start = 0
-        for match in self.re_stops.finditer(s, overlapped=True):
-            index = match.start() + 3
-            if index % 3 != 0:
-                continue
-            n = s[start:index]
-            for (offset, n, t) in self.start_chop_and_trans(n):
-                if n and len(t) >= self.min_len:
-                    yield start + offset, n, t
-            start = index
+        for (_, offset, n, t) in self.scanner.frames(s, self.min_len, frames=(0,)):
+            yield offset, n, t
 
     def putative_genes_in_sequence(self, nuc_seq):
         """Returns start, end, strand, nucleotides, protein.
@@ -133,16 +245,14 @@ class OrfFinder(object):
         answer = []
         full_len = len(nuc_seq)
 
-        for frame in range(0, 3):
-            for offset, n, t in self.break_up_frame(nuc_seq[frame:]):
-                start = frame + offset  # zero based
-                answer.append((start, start + len(n), +1, n, t))
+        for frame, offset, n, t in self.scanner.frames(nuc_seq, self.min_len):
+            start = frame + offset  # zero based
+            answer.append((start, start + len(n), +1, n, t))
 
         rc = reverse_complement(nuc_seq)
-        for frame in range(0, 3):
-            for offset, n, t in self.break_up_frame(rc[frame:]):
-                start = full_len - frame - offset  # zero based
-                answer.append((start, start - len(n), -1, n, t))
+        for frame, offset, n, t in self.scanner.frames(rc, self.min_len):
+            start = full_len - frame - offset  # zero based
+            answer.append((start, start - len(n), -1, n, t))
         answer.sort()
         return answer
 
@@ -155,16 +265,14 @@ class OrfFinder(object):
         # rather than making a list and sorting?
         full_len = len(nuc_seq)
         if self.strand != "reverse":
-            for frame in range(0, 3):
-                for offset, n, t in self.break_up_frame(nuc_seq[frame:]):
-                    start = frame + offset  # zero based
-                    yield (start, start + len(n), +1, n, t)
+            for frame, offset, n, t in self.scanner.frames(nuc_seq, self.min_len):
+                start = frame + offset  # zero based
+                yield (start, start + len(n), +1, n, t)
         if self.strand != "forward":
             rc = reverse_complement(nuc_seq)
-            for frame in range(0, 3):
-                for offset, n, t in self.break_up_frame(rc[frame:]):
-                    start = full_len - frame - offset  # zero based
-                    yield (start - len(n), start, -1, n, t)
+            for frame, offset, n, t in self.scanner.frames(rc, self.min_len):
+                start = full_len - frame - offset  # zero based
+                yield (start - len(n), start, -1, n, t)
 
 
 class MGAFinder(object):
@@ -177,72 +285,20 @@ class MGAFinder(object):
         self.min_len = min_len
         self.starts = sorted(self.table_obj.start_codons)
         self.stops = sorted(self.table_obj.stop_codons)
-        self.re_starts = re.compile("|".join(self.starts))
-        self.re_stops = re.compile("|".join(self.stops))
+        self.scanner = CodonScanner(table, self.starts, self.stops)
 
-    def locate(self, fasta_file, out_nuc, out_prot, out_bed, out_gff3):
-        seq_format = "fasta"
+    def locate(self, fasta_file, out_nuc, out_prot, out_bed, out_gff3, compression=None):
         log.debug("Genetic code table %i" % self.table)
         log.debug("Minimum length %i aa" % self.min_len)
 
-        out_count = 0
-
-        out_gff3.write('##gff-version 3\n')
-
-        for idx, record in enumerate(SeqIO.parse(fasta_file, seq_format)):
-            for i, (f_start, f_end, f_strand, n, t) in enumerate(self.get_all_peptides(str(record.seq).upper())):
-                out_count += 1
-
-                descr = "length %i aa, %i bp, from %s..%s[%s] of %s" \
-                        % (len(t), len(n), f_start, f_end, f_strand, record.description)
-                fid = record.id + "|%s%i" % (self.ftype, i + 1)
-
-                r = SeqRecord(Seq(n), id=fid, name="", description=descr)
-                t = SeqRecord(Seq(t), id=fid, name="", description=descr)
-
-                SeqIO.write(r, out_nuc, "fasta")
-                SeqIO.write(t, out_prot, "fasta")
-
-                nice_strand = '+' if f_strand == +1 else '-'
-
-                out_bed.write('\t'.join(map(str, [
-                    record.id, f_start, f_end, fid, 0, nice_strand])) + '\n')
-
-                out_gff3.write('\t'.join(map(str, [
-                    record.id, 'getOrfsOrCds', 'CDS', f_start + 1, f_end, '.',
-                    nice_strand, 0, 'ID=%s.%s.%s' % (self.ftype, idx, i + 1)])) + '\n')
+        writer = OrfWriter(out_nuc, out_prot, out_bed, out_gff3, self.ftype, compression=compression)
+        out_count = writer.write_all(self, fasta_file)
         log.info("Found %i %ss", out_count, self.ftype)
 
-    def start_chop_and_trans(self, s, strict=True):
-        """Returns offset, trimmed nuc, protein."""
-        if strict:
-            assert s[-3:] in self.stops, s
-        assert len(s) % 3 == 0
-        for match in self.re_starts.finditer(s, overlapped=True):
-            # Must check the start is in frame
-            start = match.start()
-            if start % 3 == 0:
-                n = s[start:]
-                assert len(n) % 3 == 0, "%s is len %i" % (n, len(n))
-                if strict:
-                    t = translate(n, self.table)
-                else:
-                    # Use when missing stop codon,
-                    t = "M" + translate(n[3:], self.table, to_stop=True)
-                yield start, n, t
-
     def break_up_frame(self, s):
         """Returns offset, nuc, protein."""
-        start = 0
-        for match in self.re_stops.finditer(s, overlapped=True):
-            index = match.start() + 3
-            if index % 3 != 0:
-                continue
-            n = s[start:index]
-            for (offset, n, t) in self.start_chop_and_trans(n):
-                if n and len(t) >= self.min_len:
-                    yield start + offset, n, t
-            start = index
+        for (_, offset, n, t) in self.scanner.frames(s, self.min_len, frames=(0,)):
+            yield offset, n, t
 
     def putative_genes_in_sequence(self, nuc_seq):
         """Returns start, end, strand, nucleotides, protein.
@@ -254,16 +310,14 @@ class MGAFinder(object):
         answer = []
         full_len = len(nuc_seq)
 
-        for frame in range(0, 3):
-            for offset, n, t in self.break_up_frame(nuc_seq[frame:]):
-                start = frame + offset  # zero based
-                answer.append((start, start + len(n), +1, n, t))
+        for frame, offset, n, t in self.scanner.frames(nuc_seq, self.min_len):
+            start = frame + offset  # zero based
+            answer.append((start, start + len(n), +1, n, t))
 
         rc = reverse_complement(nuc_seq)
-        for frame in range(0, 3):
-            for offset, n, t in self.break_up_frame(rc[frame:]):
-                start = full_len - frame - offset  # zero based
-                answer.append((start, start - len(n), -1, n, t))
+        for frame, offset, n, t in self.scanner.frames(rc, self.min_len):
+            start = full_len - frame - offset  # zero based
+            answer.append((start, start - len(n), -1, n, t))
         answer.sort()
         return answer
 
@@ -275,12 +329,10 @@ class MGAFinder(object):
         # TODO - Refactor to use a generator function (in start order)
         # rather than making a list and sorting?
         full_len = len(nuc_seq)
-        for frame in range(0, 3):
-            for offset, n, t in self.break_up_frame(nuc_seq[frame:]):
-                start = frame + offset  # zero based
-                yield (start, start + len(n), +1, n, t)
+        for frame, offset, n, t in self.scanner.frames(nuc_seq, self.min_len):
+            start = frame + offset  # zero based
+            yield (start, start + len(n), +1, n, t)
         rc = reverse_complement(nuc_seq)
-        for frame in range(0, 3):
-            for offset, n, t in self.break_up_frame(rc[frame:]):
-                start = full_len - frame - offset  # zero based
-                yield (start - len(n), start, -1, n, t)
+        for frame, offset, n, t in self.scanner.frames(rc, self.min_len):
+            start = full_len - frame - offset  # zero based
+            yield (start - len(n), start, -1, n, t)
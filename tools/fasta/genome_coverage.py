@@ -0,0 +1 @@
+../gff3/genome_coverage.py
\ No newline at end of file
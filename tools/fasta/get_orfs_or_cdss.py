@@ -27,8 +27,9 @@ if __name__ == '__main__':
     parser.add_argument('--op', dest='out_prot', type=argparse.FileType('w'), default='out.fa', help='Output protein sequences')
     parser.add_argument('--ob', dest='out_bed', type=argparse.FileType('w'), default='out.bed', help='Output BED file')
     parser.add_argument('--og', dest='out_gff3', type=argparse.FileType('w'), default='out.gff3', help='Output GFF3 file')
+    parser.add_argument('--compress', dest='compression', choices=('gzip', 'bgzip'), default=None, help='Compress all outputs')
     parser.add_argument('-v', action='version', version='0.3.0')
     args = parser.parse_args()
 
     of = OrfFinder(args.table, args.ftype, args.ends, args.min_len, args.strand)
-    of.locate(args.fasta_file, args.out_nuc, args.out_prot, args.out_bed, args.out_gff3)
+    of.locate(args.fasta_file, args.out_nuc, args.out_prot, args.out_bed, args.out_gff3, compression=args.compression)
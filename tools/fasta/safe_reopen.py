@@ -2,7 +2,7 @@
 import sys
 import argparse
 import logging
-from intervaltree import IntervalTree
+import genome_coverage
 from Bio import SeqIO
 from BCBio import GFF
 logging.basicConfig(level=logging.INFO)
@@ -10,31 +10,32 @@ log = logging.getLogger()
 
 
 def extract_gff3_regions(gff3_files):
-    data = {}
+    """Per base coverage of the top level features of each record"""
+    intervals = {}
+    lengths = {}
     for file in gff3_files:
         for record in GFF.parse(file):
-            if record.id not in data:
-                data[record.id] = IntervalTree()
-
-            for gene in record.features:
-                if gene.type in ('remark', 'DNA', 'annotation'):
-                    continue
+            if record.id not in intervals:
+                intervals[record.id] = []
 
-                data[record.id][int(gene.location.start):int(gene.location.end)] = True
+            intervals[record.id].extend(
+                gene for gene in record.features
+                if gene.type not in ('remark', 'DNA', 'annotation')
+            )
+            lengths[record.id] = max(lengths.get(record.id, 0), len(record))
 
-            # Mark off the end of the genome as not available.
-            data[record.id][len(record):(len(record) + 1)] = True
-    # Merge overlapping intervals
-    for key in data:
-        data[key].merge_overlaps()
+    data = {}
+    for key in intervals:
+        (starts, ends, _) = genome_coverage.feature_intervals(intervals[key])
+        data[key] = genome_coverage.coverage(starts, ends, lengths[key])
     return data
 
 
-def gaps(interval):
-    sinterval = list(sorted(interval.items()))
-    for i in range(len(sinterval) - 1):
-        # Do we really care if we don't yield the wrap around one?
-        yield (sinterval[i].end, sinterval[i + 1].begin)
+def gaps(depth):
+    # Do we really care if we don't yield the wrap around one?
+    for (start, end) in genome_coverage.gaps(depth):
+        if start > 0:
+            yield (start, end)
 
 
 def nearest_gap(gaps, position, strand):
@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 import BIO_FIX_TOPO  # NOQA
 import argparse
-import svgwrite
+import sys
 from Bio import SeqIO
+from svgstream import SvgWriter, PathRuns, box
 
 import logging
 logging.basicConfig(level=logging.INFO)
@@ -21,23 +22,27 @@ def get_boxes(features):
     return boxes
 
 
-def plot_boxes(parent=None, box_size=20):
-    records = list(SeqIO.parse(parent, "genbank"))
+def plot_boxes(parent=None, box_size=20, output=None):
+    if output is None:
+        output = sys.stdout
+
+    # Only the colours are kept from each record, so the records can be
+    # read one at a time.
     extracted = []
     name_list = []
     max_len = 0
-    max_size = len(records)
-    for i in range(len(records)):
+    for record in SeqIO.parse(parent, "genbank"):
         # Only do CDSs
-        next_row = get_boxes([f for f in records[i].features if f.type ==
+        next_row = get_boxes([f for f in record.features if f.type ==
                               'CDS'])
         extracted.append(next_row)
         if len(next_row) > max_len:
             max_len = len(next_row)
-        desc = records[i].description
+        desc = record.description
         if ',' in desc:
             desc = desc[:desc.index(',')]
-        name_list.append(records[i].id + " " + desc)
+        name_list.append(record.id + " " + desc)
+    max_size = len(extracted)
 
     left_side_gap = 400
 
@@ -52,13 +57,14 @@ def plot_boxes(parent=None, box_size=20):
     width = calc_x(max_len) + 1
     # Height is calculated much the same, plus some spacing (4px)
     height = calc_y(max_size) + 1
-    svg_document = svgwrite.Drawing(size=("%spx" % width, "%spx" % height))
+    svg_document = SvgWriter(output, "%spx" % width, "%spx" % height)
 
     for row_idx, gbk_name in zip(range(len(extracted)), name_list):
         row = extracted[row_idx]
-        svg_document.add(svg_document.text(gbk_name,
-                                           insert=(calc_x(0) - left_side_gap,
-                                                   calc_y(row_idx + 0.5))))
+        svg_document.text(gbk_name, x=calc_x(0) - left_side_gap, y=calc_y(row_idx + 0.5))
+
+        # Neighbouring boxes of the same colour are drawn as one path
+        boxes = PathRuns(svg_document, stroke_width="1", stroke="black")
         for box_idx in range(len(row)):
             if row[box_idx] is not None:
                 # [0] is so we always take the "First" specified colour
@@ -66,20 +72,16 @@ def plot_boxes(parent=None, box_size=20):
                 if len(rgb) == 3:
                     color = "rgb(%s)" % ','.join(rgb)
                 else:
-                    print rgb
+                    log.warn("Ignoring colour %s", rgb)
             else:
                 if row_idx % 2 == 0:
                     color = "rgb(220,220,220)"
                 else:
                     color = "rgb(250,250,250)"
-            svg_document.add(svg_document.rect(
-                insert=(calc_x(box_idx), calc_y(row_idx)),
-                size=("%spx" % box_size, "%spx" % box_size),
-                stroke_width="1",
-                stroke="black",
-                fill=color))
+            boxes.add(box(calc_x(box_idx), calc_y(row_idx), box_size, box_size), fill=color)
+        boxes.flush()
 
-    return svg_document.tostring()
+    svg_document.close()
 
 
 if __name__ == '__main__':
@@ -88,4 +90,5 @@ if __name__ == '__main__':
     parser.add_argument('--box_size', type=int, help='Box size', default=20)
 
     args = parser.parse_args()
-    print plot_boxes(**vars(args))
+    plot_boxes(**vars(args))
+    sys.stdout.write('\n')
@@ -0,0 +1 @@
+../svgstream.py
\ No newline at end of file
@@ -0,0 +1,62 @@
+import numpy
+
+
+def feature_intervals(features):
+    """Start, end and strand arrays for a list of features.
+
+    Co-ordinates are python style, zero based and half open, as in
+    feature.location.
+    """
+    starts = numpy.fromiter((int(f.location.start) for f in features), dtype=numpy.int64)
+    ends = numpy.fromiter((int(f.location.end) for f in features), dtype=numpy.int64)
+    strands = numpy.fromiter((f.location.strand or 0 for f in features), dtype=numpy.int8)
+    return starts, ends, strands
+
+
+def coverage(starts, ends, genome_length):
+    """Per base depth of a set of [start, end) intervals.
+
+    Each interval adds +1 at its start and -1 at its end in a difference
+    array, and the running sum of that is the depth at every base. This is
+    O(intervals + genome_length), regardless of how long or how overlapping
+    the intervals are. Intervals are clipped to the genome.
+    """
+    starts = numpy.clip(numpy.asarray(starts, dtype=numpy.int64), 0, genome_length)
+    ends = numpy.clip(numpy.asarray(ends, dtype=numpy.int64), 0, genome_length)
+    keep = ends > starts
+
+    diff = numpy.zeros(genome_length + 1, dtype=numpy.int32)
+    numpy.add.at(diff, starts[keep], 1)
+    numpy.add.at(diff, ends[keep], -1)
+    return numpy.cumsum(diff[:-1], dtype=numpy.int32)
+
+
+def strand_coverage(features, genome_length):
+    """Per base depth of features, split by strand.
+
+    Returns a dictionary of strand (1, -1, 0 for unstranded) to depth array.
+    """
+    starts, ends, strands = feature_intervals(features)
+    return {
+        strand: coverage(starts[strands == strand], ends[strands == strand], genome_length)
+        for strand in (1, -1, 0)
+    }
+
+
+def runs(mask):
+    """[start, end) of every run of True values in a boolean array"""
+    padded = numpy.concatenate(([False], numpy.asarray(mask, dtype=bool), [False]))
+    edges = numpy.flatnonzero(padded[1:] != padded[:-1])
+    return [(int(s), int(e)) for (s, e) in zip(edges[0::2], edges[1::2])]
+
+
+def gaps(depth, min_length=0):
+    """[start, end) of every uncovered region longer than min_length"""
+    return [(s, e) for (s, e) in runs(depth == 0) if e - s > min_length]
+
+
+def covered_fraction(depth):
+    """Fraction of bases covered at least once"""
+    if len(depth) == 0:
+        return 0.0
+    return float(numpy.count_nonzero(depth)) / len(depth)
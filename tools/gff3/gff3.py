@@ -1,10 +1,175 @@
+import bisect
 import copy
 import logging
 log = logging.getLogger()
 log.setLevel(logging.WARN)
 
 
-def feature_lambda(feature_list, test, test_kwargs, subfeatures=True, parent=None, invert=False, recurse=True):
+class FeatureIndex(object):
+    """Lookup tables over a feature tree, built once per SeqRecord.
+
+    feature_lambda walks the whole feature tree every time it is called, and
+    most tools call it (via genes, coding_genes, get_rbs_from) many times
+    against the same record. A FeatureIndex flattens the tree once, in the
+    same depth first order that feature_lambda visits features, and keeps
+    type, parent/child, ID and qualifier indexes over that ordering. Since a
+    feature's descendants are a contiguous run of that ordering, "every CDS
+    below this gene" is a bisect on the CDS positions.
+
+    Pass it as ``index=`` to feature_lambda, genes, coding_genes and
+    get_rbs_from::
+
+        index = FeatureIndex(record.features)
+        for gene in coding_genes(record.features, index=index):
+            rbss = get_rbs_from(gene, index=index)
+
+    The index is a snapshot of the tree structure; if features are added,
+    removed or have their type changed afterwards, build a new one.
+    """
+
+    def __init__(self, feature_list):
+        self.roots = feature_list
+        # Every feature, depth first, pre-order.
+        self.features = []
+        self.parents = {}
+        self.by_id = {}
+        self.by_type = {}
+        # id(feature) -> (position, end of subtree)
+        self._span = {}
+        # id(sub_features list) -> owning feature
+        self._owner = {}
+        # Qualifier indexes are built on demand, one per key.
+        self._by_qualifier = {}
+        self._build(feature_list, None)
+
+    def _build(self, feature_list, parent):
+        for feature in feature_list:
+            # Same convention as feature_lambda, roots are their own parent.
+            feature._parent = parent if parent is not None else feature
+            self.parents[id(feature)] = parent
+
+            position = len(self.features)
+            self.features.append(feature)
+            self.by_type.setdefault(feature.type, []).append(position)
+            self.by_id.setdefault(feature.id, feature)
+
+            if hasattr(feature, 'sub_features'):
+                self._owner[id(feature.sub_features)] = feature
+                self._build(feature.sub_features, feature)
+            self._span[id(feature)] = (position, len(self.features))
+
+    def span(self, feature_list):
+        """Positions [lo, hi) covered by feature_list and its descendants.
+
+        Returns None if feature_list is not the root list or a sub_features
+        list of an indexed feature.
+        """
+        if feature_list is self.roots:
+            return (0, len(self.features))
+        owner = self._owner.get(id(feature_list))
+        if owner is None or owner.sub_features is not feature_list:
+            return None
+        (position, end) = self._span[id(owner)]
+        return (position + 1, end)
+
+    def parent(self, feature):
+        """Parent of the feature, or None for top level features"""
+        return self.parents.get(id(feature))
+
+    def children(self, feature):
+        return getattr(feature, 'sub_features', [])
+
+    def get(self, feature_id, default=None):
+        """Fetch a feature by ID"""
+        return self.by_id.get(feature_id, default)
+
+    def _positions_of_type(self, types, lo, hi):
+        positions = []
+        for feature_type in types:
+            type_positions = self.by_type.get(feature_type, [])
+            positions.extend(type_positions[
+                bisect.bisect_left(type_positions, lo):
+                bisect.bisect_left(type_positions, hi)
+            ])
+        if len(types) > 1:
+            positions.sort()
+        return positions
+
+    def _positions_with_qualifier(self, qualifiers, values, lo, hi):
+        positions = set()
+        for qualifier in qualifiers:
+            if qualifier not in self._by_qualifier:
+                key_index = {}
+                for position, feature in enumerate(self.features):
+                    for value in feature.qualifiers.get(qualifier, []):
+                        key_index.setdefault(value, []).append(position)
+                self._by_qualifier[qualifier] = key_index
+
+            key_index = self._by_qualifier[qualifier]
+            for value in values:
+                value_positions = key_index.get(value, [])
+                positions.update(value_positions[
+                    bisect.bisect_left(value_positions, lo):
+                    bisect.bisect_left(value_positions, hi)
+                ])
+        return sorted(positions)
+
+    def of_type(self, feature_type, feature_list=None):
+        """Features of a given type below feature_list (default: everything)"""
+        span = self.span(self.roots if feature_list is None else feature_list)
+        if span is None:
+            raise ValueError("feature_list is not part of this index")
+        (lo, hi) = span
+        return [self.features[i] for i in self._positions_of_type([feature_type], lo, hi)]
+
+    def with_qualifier(self, qualifier, value):
+        """Features where `value` is one of the values of `qualifier`"""
+        return [self.features[i] for i in self._positions_with_qualifier(
+            [qualifier], [value], 0, len(self.features))]
+
+    def candidates(self, span, test, test_kwargs, invert=False):
+        """Positions in the span which could possibly pass the test.
+
+        Type and qualifier value tests are answered from the indexes, any
+        other test has to be applied to every feature in the span.
+        """
+        (lo, hi) = span
+        if not invert and test is feature_test_type:
+            if 'type' in test_kwargs:
+                return self._positions_of_type([test_kwargs['type']], lo, hi)
+            elif 'types' in test_kwargs:
+                return self._positions_of_type(set(test_kwargs['types']), lo, hi)
+        elif not invert and test is feature_test_qual_value:
+            qualifiers = test_kwargs['qualifier']
+            if not isinstance(qualifiers, list):
+                qualifiers = [qualifiers]
+            return self._positions_with_qualifier(qualifiers, test_kwargs['attribute_list'], lo, hi)
+        return range(lo, hi)
+
+
+def record_index(record):
+    """FeatureIndex for a SeqRecord, built on first use and cached on the record.
+
+    The cached index is rebuilt if record.features has been replaced since.
+    """
+    index = getattr(record, '_feature_index', None)
+    if index is None or index.roots is not record.features:
+        index = FeatureIndex(record.features)
+        record._feature_index = index
+    return index
+
+
+def _shallow_view(feature):
+    """Copy of the feature without its sub_features.
+
+    Location and qualifiers are shared with the original feature.
+    """
+    view = copy.copy(feature)
+    view.sub_features = []
+    return view
+
+
+def feature_lambda(feature_list, test, test_kwargs, subfeatures=True, parent=None, invert=False, recurse=True, index=None):
     """Recursively search through features, testing each with a test function, yielding matches.
 
     GFF3 is a hierachical data structure, so we need to be able to recursively
@@ -41,9 +206,23 @@ def feature_lambda(feature_list, test, test_kwargs, subfeatures=True, parent=Non
     :type invert: boolean
     :param invert: Negate/invert the result of the filter.
 
+    :type index: FeatureIndex
+    :param index: a FeatureIndex built over the record's features. If
+                  feature_list is covered by it, matches are read from the
+                  index instead of walking the tree.
+
     :rtype: yielded list
     :return: Yields a list of matching features.
     """
+    if index is not None and recurse:
+        span = index.span(feature_list)
+        if span is not None:
+            for position in index.candidates(span, test, test_kwargs, invert=invert):
+                feature = index.features[position]
+                if invert ^ test(feature, **test_kwargs):
+                    yield feature if subfeatures else _shallow_view(feature)
+            return
+
     # Either the top level set of [features] or the subfeature attribute
     for feature in feature_list:
         feature._parent = parent
@@ -55,9 +234,7 @@ def feature_lambda(feature_list, test, test_kwargs, subfeatures=True, parent=Non
         # print feature.type, test_kwargs, test_result, invert ^ test_result
         if invert ^ test_result:
             if not subfeatures:
-                feature_copy = copy.deepcopy(feature)
-                feature_copy.sub_features = []
-                yield feature_copy
+                yield _shallow_view(feature)
             else:
                 yield feature
 
@@ -205,13 +382,13 @@ def ensure_location_in_bounds(start=0, end=0, parent_length=0):
     return (start, end)
 
 
-def coding_genes(feature_list):
-    for x in genes(feature_list):
-        if len(list(feature_lambda(x.sub_features, feature_test_type, {'type': 'CDS'}, subfeatures=False))) > 0:
+def coding_genes(feature_list, index=None):
+    for x in genes(feature_list, index=index):
+        if len(list(feature_lambda(x.sub_features, feature_test_type, {'type': 'CDS'}, subfeatures=True, index=index))) > 0:
             yield x
 
 
-def genes(feature_list, feature_type='gene', sort=False):
+def genes(feature_list, feature_type='gene', sort=False, index=None):
     """
     Simple filter to extract gene features from the feature set.
     """
@@ -219,10 +396,10 @@ def genes(feature_list, feature_type='gene', sort=False):
     if not sort:
         for x in feature_lambda(feature_list, feature_test_type,
                                 {'type': feature_type},
-                                subfeatures=True):
+                                subfeatures=True, index=index):
             yield x
     else:
-        data = list(genes(feature_list, feature_type=feature_type, sort=False))
+        data = list(genes(feature_list, feature_type=feature_type, sort=False, index=index))
         data = sorted(data, key=lambda feature: feature.location.start)
         for x in data:
             yield x
@@ -251,15 +428,15 @@ def is_uuid(name):
     return name.count('-') == 4 and len(name) == 36
 
 
-def get_rbs_from(gene):
+def get_rbs_from(gene, index=None):
     # Normal RBS annotation types
-    rbs_rbs = list(feature_lambda(gene.sub_features, feature_test_type, {'type': 'RBS'}, subfeatures=False))
-    rbs_sds = list(feature_lambda(gene.sub_features, feature_test_type, {'type': 'Shine_Dalgarno_sequence'}, subfeatures=False))
+    rbs_rbs = list(feature_lambda(gene.sub_features, feature_test_type, {'type': 'RBS'}, subfeatures=False, index=index))
+    rbs_sds = list(feature_lambda(gene.sub_features, feature_test_type, {'type': 'Shine_Dalgarno_sequence'}, subfeatures=False, index=index))
     # Fraking apollo
-    apollo_exons = list(feature_lambda(gene.sub_features, feature_test_type, {'type': 'exon'}, subfeatures=False))
+    apollo_exons = list(feature_lambda(gene.sub_features, feature_test_type, {'type': 'exon'}, subfeatures=False, index=index))
     apollo_exons = [x for x in apollo_exons if len(x) < 10]
     # These are more NCBI's style
-    regulatory_elements = list(feature_lambda(gene.sub_features, feature_test_type, {'type': 'regulatory'}, subfeatures=False))
+    regulatory_elements = list(feature_lambda(gene.sub_features, feature_test_type, {'type': 'regulatory'}, subfeatures=False, index=index))
     rbs_regulatory = list(feature_lambda(regulatory_elements, feature_test_quals, {'regulatory_class': ['ribosome_binding_site']}, subfeatures=False))
     # Here's hoping you find just one ;)
     return rbs_rbs + rbs_sds + rbs_regulatory + apollo_exons
@@ -5,6 +5,7 @@ import logging
 import argparse
 from BCBio import GFF
 from gff3 import feature_lambda, wa_unified_product_name
+from pattern_classifier import PatternClassifier
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
@@ -246,12 +247,10 @@ class ColorScheme(object):
         self.custom_regex = {}
         for key in color_scheme:
             for member in color_scheme[key]['members']:
-                regex = re.compile(member, re.IGNORECASE)
-                color = color_scheme[key]['color']
+                # Compiled all together by PatternClassifier, below
                 self.standard_regex[member] = {
                     'str': member,
-                    'regex': regex,
-                    'color': color
+                    'color': color_scheme[key]['color'],
                 }
 
             if 'custom' in color_scheme[key]:
@@ -263,51 +262,46 @@ class ColorScheme(object):
                         'isnot': [re.compile('\b' + x + '\b') for x in cu.get('isnot', [])],
                     }
 
-    def get_color(self, product_list):
-
-        for product in product_list:
-            if product is None:
-                continue
+        self.classifier = PatternClassifier(
+            [(member['str'], member['color']) for member in self.standard_regex.values()],
+            flags=re.IGNORECASE
+        )
+        self._colors = {}
 
-            matched = None
-            for regex in self.standard_regex:
+    def product_color(self, product):
+        """Color for a single product, or None.
 
-                if re.search(self.standard_regex[regex]['regex'], product):
-                    matched = self.standard_regex[regex]['color']
+        The standard members are tried with one combined regex (the last
+        member in self.standard_regex to match wins) and the custom rules
+        then override it. Results are remembered per product, as the same
+        few product names recur throughout a genome.
+        """
+        if product not in self._colors:
+            matched = self.classifier.classify(product)
 
             for regex in self.custom_regex:
-                care = False
-
-                for re_is in self.custom_regex[regex]['is']:
-                    if re.search(re_is, product):
-                        care = True
+                # COPYPASTA from original perl:
+                # Fixes a strange bug. If we have a match, and then
+                # we have a subpart of that match which hits a custom
+                # element, we want to make sure that it'll ONLY overwrite
+                # if we didn't specifically exclude items like the one we
+                # hit.
+                rule = self.custom_regex[regex]
+                if rule['is'] and \
+                        all(re_is.search(product) for re_is in rule['is']) and \
+                        not any(re_isnot.search(product) for re_isnot in rule['isnot']):
+                    matched = rule['color']
 
-                for re_isnot in self.custom_regex[regex]['isnot']:
-                    if re.search(re_isnot, product):
-                        care = False
+            self._colors[product] = matched
+        return self._colors[product]
 
-                if care:
-                    is_ok = True
-                    ok_to_overwrite = True
-
-                    # COPYPASTA from original perl:
-                    # Fixes a strange bug. If we have a match, and then
-                    # we have a subpart of that match which hits a custom
-                    # element, we want to make sure that it'll ONLY overwrite
-                    # if we didn't specifically exclude items like the one we
-                    # hit.
-                    for re_is in self.custom_regex[regex]['is']:
-                        if not re.search(re_is, product):
-                            is_ok = False
-
-                    for re_isnot in self.custom_regex[regex]['isnot']:
-                        if re.search(re_isnot, product):
-                            ok_to_overwrite = False
-                            is_ok = False
+    def get_color(self, product_list):
 
-                    if is_ok and ok_to_overwrite:
-                        matched = self.custom_regex[regex]['color']
+        for product in product_list:
+            if product is None:
+                continue
 
+            matched = self.product_color(product)
             if matched is not None:
                 log.info('%s -> %s', product, matched)
                 return matched
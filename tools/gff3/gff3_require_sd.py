@@ -5,7 +5,7 @@ import argparse
 from Bio import SeqIO
 from BCBio import GFF
 from gff3 import feature_lambda, feature_test_type
-from shinefind import NaiveSDCaller
+from shinefind import NaiveSDCaller, SDIndex
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
@@ -16,6 +16,7 @@ def require_shinefind(gff3, fasta):
     seq_dict = SeqIO.to_dict(SeqIO.parse(fasta, "fasta"))
     # Parse GFF3 records
     for record in GFF.parse(gff3, base_dict=seq_dict):
+        sd_index = SDIndex(record.seq, sd_finder=sd_finder)
         # Reopen
         genes = list(feature_lambda(record.features, feature_test_type, {'type': 'gene'}, subfeatures=True))
         good_genes = []
@@ -27,7 +28,7 @@ def require_shinefind(gff3, fasta):
             # Someday this will bite me in the arse.
             cds = cdss[0]
 
-            sds, start, end, seq = sd_finder.testFeatureUpstream(cds, record, sd_min=5, sd_max=15)
+            sds, start, end, seq = sd_finder.testFeatureUpstream(cds, record, sd_min=5, sd_max=15, sd_index=sd_index)
             if len(sds) >= 1:
                 # TODO
                 # Double plus yuck
@@ -0,0 +1,59 @@
+"""
+Classify strings (e.g. product names) by a list of regular expressions,
+shared by gff3_color and the PHAnTASM cassette tools.
+"""
+import re
+
+# Python 2's re allows at most 100 groups per pattern
+MAX_GROUPS = 99
+
+
+class PatternClassifier(object):
+    """The value of the last of a list of (pattern, value) pairs whose
+    pattern matches a string, as if each pattern were tried in turn.
+
+    The patterns are compiled into one alternation, highest priority (i.e.
+    last) first, with each run of patterns sharing a value in one named
+    group. Every alternative is unanchored (``[\\s\\S]*?pattern``, like
+    re.search) unless anchored=True (like re.match), so the alternation
+    succeeds on the first alternative that matches anywhere, and its group
+    names the value. Very long lists are split over several alternations.
+    """
+
+    def __init__(self, members, flags=0, anchored=False):
+        runs = []
+        for (pattern, value) in reversed(list(members)):
+            if runs and runs[-1][0] == value:
+                runs[-1][1].append(pattern)
+            else:
+                runs.append((value, [pattern]))
+
+        prefix = '' if anchored else r'[\s\S]*?'
+        self.regexes = []
+        alternatives = []
+        values = {}
+        groups = 0
+        for (value, patterns) in runs:
+            size = 1 + sum(re.compile(pattern, flags).groups for pattern in patterns)
+            if groups + size > MAX_GROUPS and alternatives:
+                self.regexes.append((re.compile('|'.join(alternatives), flags), values))
+                alternatives = []
+                values = {}
+                groups = 0
+
+            name = 'v%d' % len(values)
+            values[name] = value
+            alternatives.append('(?P<%s>%s(?:%s))' % (
+                name, prefix, '|'.join('(?:%s)' % pattern for pattern in patterns)))
+            groups += size
+
+        if alternatives:
+            self.regexes.append((re.compile('|'.join(alternatives), flags), values))
+
+    def classify(self, text):
+        """Value for text, or None if no pattern matches"""
+        for (regex, values) in self.regexes:
+            m = regex.match(text)
+            if m is not None:
+                return values[m.lastgroup]
+        return None
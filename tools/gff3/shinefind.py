@@ -1,10 +1,12 @@
 #!/usr/bin/env python
-import re
 import sys
+import numpy
+import bisect
 import argparse
 import logging
 from BCBio import GFF
 from Bio import SeqIO
+from Bio.Seq import reverse_complement
 from Bio.SeqRecord import SeqRecord
 from Bio.SeqFeature import SeqFeature, FeatureLocation
 from gff3 import feature_lambda, feature_test_type, feature_test_true, feature_test_quals, get_id, \
@@ -38,21 +40,102 @@ class NaiveSDCaller(object):
     )
 
     def __init__(self):
-        self.sd_reg = [re.compile(x, re.IGNORECASE) for x in self.SD_SEQUENCES]
+        # Trie of the SD motifs, the None key of a node holds the index of the
+        # motif ending there.
+        self.sd_trie = {}
+        for idx, motif in enumerate(self.SD_SEQUENCES):
+            node = self.sd_trie
+            for base in motif.upper():
+                node = node.setdefault(base, {})
+            node[None] = idx
+        self.sd_max_len = max(len(x) for x in self.SD_SEQUENCES)
+
+    def scan(self, sequence):
+        """Find every (possibly overlapping) occurrence of every SD motif.
+
+        One pass over the sequence, walking the motif trie from each
+        position. Yields (motif index, start) ordered by start.
+        """
+        upper = sequence.upper()
+        for start in range(len(upper)):
+            node = self.sd_trie
+            for base in upper[start:start + self.sd_max_len]:
+                node = node.get(base)
+                if node is None:
+                    break
+                if None in node:
+                    yield node[None], start
+
+    def _non_overlapping(self, motif_starts):
+        """Per motif, keep the leftmost non-overlapping occurrences (as a regex
+        search for that motif would find them)."""
+        for idx, starts in enumerate(motif_starts):
+            length = len(self.SD_SEQUENCES[idx])
+            last_end = 0
+            for start in starts:
+                if start >= last_end:
+                    last_end = start + length
+                    yield idx, start, last_end
 
     def list_sds(self, sequence):
+        motif_starts = [[] for _ in self.SD_SEQUENCES]
+        for (idx, start) in self.scan(sequence):
+            motif_starts[idx].append(start)
+        return self.hits_from_starts(sequence, motif_starts)
+
+    def hits_from_starts(self, sequence, motif_starts):
+        """list_sds results from the per motif (sorted) starts of every
+        occurrence in sequence"""
         hits = []
-        for regex in self.sd_reg:
-            for match in regex.finditer(sequence):
-                hits.append({
-                    'spacing': len(sequence) - len(match.group()) - match.start(),
-                    'hit': match.group(),
-                    'start': match.start(),
-                    'end': match.end(),
-                    'len': len(match.group()),
-                })
+        for (idx, start, end) in self._non_overlapping(motif_starts):
+            hits.append({
+                'spacing': len(sequence) - (end - start) - start,
+                'hit': sequence[start:end],
+                'start': start,
+                'end': end,
+                'len': end - start,
+            })
         return hits
 
+    def list_sds_batch(self, sequences):
+        """Find SDs in many sequences (e.g. every upstream window of a genome)
+        in a single scan.
+
+        Returns a dictionary of numpy arrays, with one entry per hit: the
+        index of the sequence it was found in ('sequence'), the index of the
+        motif in SD_SEQUENCES ('motif'), and 'start', 'end', 'spacing' and
+        'len' as in list_sds. Hits for each sequence are in the same order
+        list_sds returns them.
+        """
+        # Separator can't be part of any motif, so hits never span sequences.
+        joined = '|'.join(sequences)
+        lengths = numpy.array([len(x) for x in sequences], dtype=numpy.int64)
+        offsets = numpy.concatenate(([0], numpy.cumsum(lengths + 1)[:-1]))
+
+        # sequence index -> per motif starts
+        found = {}
+        for (idx, start) in self.scan(joined):
+            seq_idx = numpy.searchsorted(offsets, start, side='right') - 1
+            if seq_idx not in found:
+                found[seq_idx] = [[] for _ in self.SD_SEQUENCES]
+            found[seq_idx][idx].append(start - offsets[seq_idx])
+
+        hits = []
+        for seq_idx in sorted(found):
+            for (idx, start, end) in self._non_overlapping(found[seq_idx]):
+                hits.append((seq_idx, idx, start, end))
+
+        hits = numpy.array(hits, dtype=numpy.int64).reshape(-1, 4)
+        sequence, motif, start, end = hits.T
+        return {
+            'sequence': sequence,
+            'motif': motif,
+            'start': start,
+            'end': end,
+            'len': end - start,
+            'spacing': lengths[sequence] - (end - start) - start,
+        }
+
     @classmethod
     def highlight_sd(cls, sequence, start, end):
         return ' '.join([
@@ -93,7 +176,12 @@ class NaiveSDCaller(object):
             results.append(tmp)
         return results
 
-    def testFeatureUpstream(self, feature, record, sd_min=5, sd_max=15):
+    def testFeatureUpstream(self, feature, record, sd_min=5, sd_max=15, sd_index=None):
+        """SDs in the sd_min..sd_max bases upstream of a feature.
+
+        If an SDIndex of the record is supplied, hits come from that rather
+        than from scanning the upstream sequence.
+        """
         # Strand information necessary to getting correct upstream sequence
         # TODO: library?
         strand = feature.location.strand
@@ -108,6 +196,9 @@ class NaiveSDCaller(object):
         (start, end) = ensure_location_in_bounds(start=start, end=end,
                                                  parent_length=record.__len__)
 
+        if sd_index is not None:
+            return sd_index.list_sds(start, end, strand), start, end, sd_index.sequence(start, end, strand)
+
         # Create our temp feature used to obtain correct portion of
         # genome
         tmp = SeqFeature(FeatureLocation(start, end, strand=strand),
@@ -120,6 +211,81 @@ class NaiveSDCaller(object):
         return len(sds) > 0
 
 
+class SDIndex(object):
+    """Every SD motif occurrence in a genome, on both strands.
+
+    The forward sequence and its reverse complement are scanned once, and
+    the starts of each motif kept in sorted lists. The SDs of any window
+    (i.e. the lookahead region of any gene, for any lookahead_min/max) are
+    then a bisect of those lists rather than a new scan of the window.
+    """
+
+    def __init__(self, sequence, sd_finder=None):
+        self.sd_finder = sd_finder or NaiveSDCaller()
+        self.forward = str(sequence)
+        self.reverse = reverse_complement(self.forward)
+        self.length = len(self.forward)
+        self.motif_starts = {
+            1: self._motif_starts(self.forward),
+            -1: self._motif_starts(self.reverse),
+        }
+
+    def _motif_starts(self, sequence):
+        bases = numpy.frombuffer(sequence.upper(), dtype=numpy.uint8)
+        motif_starts = []
+        for motif in self.sd_finder.SD_SEQUENCES:
+            positions = len(bases) - len(motif) + 1
+            if positions <= 0:
+                motif_starts.append([])
+                continue
+            match = numpy.ones(positions, dtype=bool)
+            for (offset, base) in enumerate(motif.upper()):
+                match &= bases[offset:offset + positions] == ord(base)
+            motif_starts.append(numpy.flatnonzero(match).tolist())
+        return motif_starts
+
+    def _window(self, start, end, strand):
+        """Strand and [start, end) of the window on that strand's sequence,
+        clipped to the genome. Anything not on the reverse strand is read
+        forward, as with SeqFeature.extract."""
+        start = max(start, 0)
+        end = max(min(end, self.length), start)
+        if strand == -1:
+            return -1, self.length - end, self.length - start
+        return 1, start, end
+
+    def sequence(self, start, end, strand):
+        """Sequence of [start, end) read along strand"""
+        strand, start, end = self._window(start, end, strand)
+        if strand == -1:
+            return self.reverse[start:end]
+        return self.forward[start:end]
+
+    def list_sds(self, start, end, strand):
+        """Same as NaiveSDCaller.list_sds(self.sequence(start, end, strand))"""
+        strand, start, end = self._window(start, end, strand)
+        window_starts = []
+        for (motif, starts) in zip(self.sd_finder.SD_SEQUENCES, self.motif_starts[strand]):
+            lo = bisect.bisect_left(starts, start)
+            hi = bisect.bisect_right(starts, end - len(motif))
+            window_starts.append([x - start for x in starts[lo:hi]])
+
+        if strand == -1:
+            sequence = self.reverse[start:end]
+        else:
+            sequence = self.forward[start:end]
+        return self.sd_finder.hits_from_starts(sequence, window_starts)
+
+
+def record_sd_index(record, sd_finder=None):
+    """SDIndex for a SeqRecord, built on first use and cached on the record."""
+    index = getattr(record, '_sd_index', None)
+    if index is None:
+        index = SDIndex(record.seq, sd_finder=sd_finder)
+        record._sd_index = index
+    return index
+
+
 def fminmax(feature):
     fmin = None
     fmax = None
@@ -161,6 +327,7 @@ def shinefind(fasta, gff3, gff3_output=None, table_output=None, lookahead_min=5,
     for record in GFF.parse(gff3, base_dict=seq_dict):
         # Shinefind's "gff3_output".
         gff3_output_record = SeqRecord(record.seq, record.id)
+        sd_index = SDIndex(record.seq, sd_finder=sd_finder)
         # Filter out just coding sequences
         ignored_features = []
         for x in record.features:
@@ -200,7 +367,8 @@ def shinefind(fasta, gff3, gff3_output=None, table_output=None, lookahead_min=5,
                 ignored_features.append(gene)
                 continue
 
-            sds, start, end, seq = sd_finder.testFeatureUpstream(feature, record, sd_min=lookahead_min, sd_max=lookahead_max)
+            sds, start, end, seq = sd_finder.testFeatureUpstream(feature, record, sd_min=lookahead_min, sd_max=lookahead_max,
+                                                                 sd_index=sd_index)
 
             feature_id = get_id(feature)
             sd_features = sd_finder.to_features(sds, feature.location.strand, start, end, feature_id=feature.id)
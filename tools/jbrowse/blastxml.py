@@ -0,0 +1 @@
+../blast/blastxml.py
\ No newline at end of file
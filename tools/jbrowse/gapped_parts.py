@@ -0,0 +1 @@
+../blast/gapped_parts.py
\ No newline at end of file
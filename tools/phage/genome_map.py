@@ -1,13 +1,16 @@
 #!/usr/bin/env python
 # vim: set fileencoding=utf-8
 import base64
+import bisect
 import argparse
-import svgwrite
+import numpy
+import sys
 import logging
+from svgstream import SvgWriter, PathRuns, box, vertical
 from gff3 import feature_lambda, feature_test_type, get_gff3_id, wa_unified_product_name
 from BCBio import GFF
 from Bio import SeqIO
-from Bio.SeqFeature import FeatureLocation, ExactPosition
+from Bio.SeqFeature import ExactPosition
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger()
 
@@ -147,6 +150,8 @@ class Plotter(object):
 
         self.rowdata = []
         self._internal_maxrowlength = 0
+        # (rowData, row numbers, starts, ends) for calculateRow
+        self._row_bounds = None
 
         self.cs = DEFAULT_COLOR_SCHEME
         self.classes = {}
@@ -177,19 +182,36 @@ class Plotter(object):
         if feature.type in self.classes:
             self.classes[feature.type].addObject(obj)
 
-    def partitionLines(self, split_factor=1.05):
-        avgRowLength = int(float(self.genome_length) / float(self.rows * split_factor))
+    def sortedLocations(self):
+        """Starts and ends of every location rows are laid out around, sorted
+        by start (stably, so ties keep their order)
 
+        Alongside the plotted features, there are 100 evenly spaced empty
+        locations, so that rows can also be split where there are no
+        features.
+        """
         fake_count = 100
 
         items = []
         for i in range(fake_count):
             key = int(float(self.genome_length * i) / fake_count)
-            items.append(FeatureLocation(key, key, strand=1))
+            items.append((key, key))
 
         for x in self.classes:
             if self.classes[x].included:
-                items += [y.location for y in self.classes[x].objects]
+                items += [(int(y.location.start), int(y.location.end)) for y in self.classes[x].objects]
+
+        items.sort(key=lambda x: x[0])
+        starts = [start for (start, end) in items]
+        ends = numpy.array([end for (start, end) in items], dtype=numpy.int64)
+        return starts, ends
+
+    def partitionLines(self, split_factor=1.05, locations=None):
+        avgRowLength = int(float(self.genome_length) / float(self.rows * split_factor))
+
+        if locations is None:
+            locations = self.sortedLocations()
+        (starts, ends) = locations
 
         longest_last_object = 1
         thisRowEnd = 1 + avgRowLength
@@ -202,28 +224,42 @@ class Plotter(object):
             }
         }
 
-        for item in sorted(items, key=lambda x: x.start):
-            if item.start >= thisRowEnd or item.end > thisRowEnd:
+        # Row ends only move forward, so a location which fit in an earlier
+        # row never starts a new one. Each row is ended by the next location
+        # (after the one that started it) starting at or after its end, or
+        # reaching past it.
+        idx = 0
+        while idx < len(starts):
+            past_end = bisect.bisect_left(starts, thisRowEnd, idx)
+            overhanging = numpy.flatnonzero(ends[idx:past_end] > thisRowEnd)
+            if len(overhanging):
+                idx += int(overhanging[0])
+            else:
+                idx = past_end
+            if idx >= len(starts):
+                break
+            item_start = starts[idx]
 
-                if self.justified or item.start >= rowData[currentRow]['end']:
-                    rowData[currentRow]['end'] = thisRowEnd
-                else:
-                    rowData[currentRow]['end'] = max(longest_last_object, item.start)
+            if self.justified or item_start >= rowData[currentRow]['end']:
+                rowData[currentRow]['end'] = thisRowEnd
+            else:
+                rowData[currentRow]['end'] = max(longest_last_object, item_start)
 
-                _internal_maxrowlength = max(
-                    _internal_maxrowlength,
-                    rowData[currentRow]['end'] - rowData[currentRow]['start']
-                )
+            _internal_maxrowlength = max(
+                _internal_maxrowlength,
+                rowData[currentRow]['end'] - rowData[currentRow]['start']
+            )
 
-                currentRow += 1
-                rowData[currentRow] = {}
+            currentRow += 1
+            rowData[currentRow] = {}
 
-                if item.start <= rowData[currentRow - 1]['end']:
-                    rowData[currentRow]['start'] = item.start
-                else:
-                    rowData[currentRow]['start'] = rowData[currentRow - 1]['end'] + 1
+            if item_start <= rowData[currentRow - 1]['end']:
+                rowData[currentRow]['start'] = item_start
+            else:
+                rowData[currentRow]['start'] = rowData[currentRow - 1]['end'] + 1
 
-                thisRowEnd = avgRowLength + rowData[currentRow]['start']
+            thisRowEnd = avgRowLength + rowData[currentRow]['start']
+            idx += 1
 
         thisRowEnd = rowData[currentRow]['end'] = ExactPosition(self.genome_length + 1)
 
@@ -234,7 +270,8 @@ class Plotter(object):
 
         return rowData, avgRowLength, _internal_maxrowlength
 
-    def createSvg(self, rowData, widthOverride=0):
+    def createSvg(self, rowData, handle, widthOverride=0):
+        """Write the map to handle, a class group at a time"""
         height = int((len(rowData.keys())) * self.ils)
         width = int(float(self.avgRowLength) / self.zoom)
 
@@ -243,58 +280,49 @@ class Plotter(object):
 
         self.calc_width = width
 
-        self.svg = svgwrite.Drawing(
-            size=(
-                width + 2 * (self.x_offset),
-                height + 2 * (self.y_offset)
-            )
+        self.svg = SvgWriter(
+            handle,
+            width + 2 * (self.x_offset),
+            height + 2 * (self.y_offset)
         )
 
-        ui_group = self.svg.g(
-            id="group_ui",
-            style="stroke: #000000; fill: #000000; fill-opacity: 1;"
-        )
-
-        for i in range(1, max(rowData.keys()) + 1):
-            self.addRuler(i, ui_group, rowData)
-
         for key in self.classes:
             c = self.classes[key]
 
             if not c.plot:
                 continue
 
-            class_group = self.svg.g(
+            with self.svg.group(
                 id="group_%s" % key,
                 style="stroke: %s; fill: %s; fill-opacity: %s" % (
                     'black' if c.border else 'none', c.color, self.opacity)
-            )
-
-            for gene in c.objects:
-                svgFeature, x, y, w, h = self.featureBox(
-                    gene,
-                    rowData,
-                    class_group,
-                    self.calculateRow(gene, rowData),
-                )
-                class_group.add(svgFeature)
-
-                if gene.get_label():
-                    if self.label_hypo or (not self.label_hypo and 'ypothetical' not in gene.get_label()):
-                        # print self.label_hypo, (self.label_hypo and 'ypothetical' not in gene.get_label()), 'ypothetical' not in gene.get_label(), gene.get_label()
-                        # if not self.label_hypo or (self.label_hypo and 'ypothetical' not in gene.get_label()):
-                        svgFeatureLabel = self.featureLabel(
-                            gene, rowData, class_group,
-                            self.calculateRow(gene, rowData),
-                            gene.get_label(),
-                            x, y, w, h
-                        )
-                        class_group.add(svgFeatureLabel)
-
-            self.svg.add(class_group)
+            ):
+                # Boxes first, each run of one colour as a single path,
+                # then the labels on top of them.
+                boxes = PathRuns(self.svg)
+                for gene in c.objects:
+                    (x, y, w, h) = self.featureBox(gene, rowData, self.calculateRow(gene, rowData))
+                    boxes.add(box(x, y, w, h), style="fill:%s;stroke-width:0.5;" % gene.color)
+                boxes.flush()
+
+                for gene in c.objects:
+                    if gene.get_label():
+                        if self.label_hypo or (not self.label_hypo and 'ypothetical' not in gene.get_label()):
+                            row = self.calculateRow(gene, rowData)
+                            self.featureLabel(
+                                gene, rowData, row,
+                                gene.get_label(),
+                                *self.featureBox(gene, rowData, row)
+                            )
+
+        with self.svg.group(
+            id="group_ui",
+            style="stroke: #000000; fill: #000000; fill-opacity: 1;"
+        ):
+            for i in range(1, max(rowData.keys()) + 1):
+                self.addRuler(i, rowData)
 
-        self.svg.add(ui_group)
-        return self.svg
+        self.svg.close()
 
     def fitness(self, rowData, maxRowLength):
         score = 2
@@ -309,9 +337,18 @@ class Plotter(object):
     def optimizedPartition(self):
         bestRowData = None
         bestFitness = 0
+        locations = self.sortedLocations()
+        # Neighbouring split factors often give the same row length, and so
+        # the same layout; the first one found wins ties anyway.
+        tried = set()
         for i in range(70, 200):
             s = float(i) / 100
-            results = self.partitionLines(split_factor=s)
+            avgRowLength = int(float(self.genome_length) / float(self.rows * s))
+            if avgRowLength in tried:
+                continue
+            tried.add(avgRowLength)
+
+            results = self.partitionLines(split_factor=s, locations=locations)
             fitness = self.fitness(results[0], results[2])
             # print s, fitness
             if fitness > bestFitness:
@@ -325,16 +362,16 @@ class Plotter(object):
     def offsetPoint(self, x, y):
         return (x + self.x_offset, y + self.y_offset)
 
-    def addRuler(self, row, ui_group, rowData):
+    def addRuler(self, row, rowData):
         y_fix = self.ils * (row - 1)
 
         line_width = self.calc_width * (rowData[row]['end'] - rowData[row]['start']) / self._internal_maxrowlength
 
-        ui_group.add(self.svg.line(
+        self.svg.line(
             start=self.offsetPoint(0, y_fix),
             end=self.offsetPoint(line_width, y_fix),
             id='ruler_%s' % row,
-        ))
+        )
 
         if self.double_line_for_overlap and row > 1:
             if rowData[row - 1]['end'] - rowData[row]['start'] >= 0:
@@ -342,7 +379,7 @@ class Plotter(object):
 
                 if line_length > 0:
 
-                    ui_group.add(self.svg.line(
+                    self.svg.line(
                         id='ruler_%s_overlap' % row,
                         start=self.offsetPoint(
                             0,
@@ -352,45 +389,50 @@ class Plotter(object):
                             line_length,
                             y_fix - 5
                         )
-                    ))
-
-        # ui_group.add(svg.line(
-            # id='ruler_%s_left_border' % row,
-            # start=self.offsetPoint(0, y_fix),
-            # end = self.offsetPoint(line_width, y_fix)
-        # ))
-
-        for idx in range(rowData[row]['start'] - 1, rowData[row]['end']):
-            if idx % 1000 == 0:
-                current_location = self.calc_width * (idx - rowData[row]['start']) / self._internal_maxrowlength
-
-                line_height = 5
-                if idx % 10000 == 0:
-                    line_height = 10
-
-                ui_group.add(self.svg.line(
-                    id='ruler_vert_%s' % idx,
-                    start=self.offsetPoint(current_location, y_fix),
-                    end=self.offsetPoint(current_location, y_fix + line_height),
-                ))
-
-                if idx % 10000 == 0:
-                    ui_group.add(self.svg.text(
-                        id='ruler_text_%s' % idx,
-                        text='%s kb' % int((idx + self.ruler_offset) / 1000),
-                        x=[current_location + 10 + self.x_offset],
-                        y=[y_fix + 20 + self.y_offset],
-                        style=FONT_STYLE,
-                    ))
+                    )
+
+        # A tick every kb, a taller one (and a label) every 10 kb. The ticks
+        # are drawn as a single path.
+        first = rowData[row]['start'] - 1
+        first += -first % 1000
+        ticks = []
+        for idx in range(first, rowData[row]['end'], 1000):
+            current_location = self.calc_width * (idx - rowData[row]['start']) / self._internal_maxrowlength
+
+            line_height = 5
+            if idx % 10000 == 0:
+                line_height = 10
+
+            ticks.append(vertical(*self.offsetPoint(current_location, y_fix), h=line_height))
+
+            if idx % 10000 == 0:
+                self.svg.text(
+                    '%s kb' % int((idx + self.ruler_offset) / 1000),
+                    id='ruler_text_%s' % idx,
+                    x=[current_location + 10 + self.x_offset],
+                    y=[y_fix + 20 + self.y_offset],
+                    style=FONT_STYLE,
+                )
+        self.svg.path(ticks, id='ruler_ticks_%s' % row)
 
     def calculateRow(self, obj, rowData):
-        for i in rowData.keys():
-            if rowData[i]['start'] - 1 <= obj.location.start < rowData[i]['end'] and \
-                    rowData[i]['start'] - 1 <= obj.location.end < rowData[i]['end']:
-                return i
+        # Row starts and ends both only move forward, so the first row
+        # ending after the feature is the only one which could hold it.
+        if self._row_bounds is None or self._row_bounds[0] is not rowData:
+            rows = sorted(rowData.keys())
+            self._row_bounds = (
+                rowData, rows,
+                [rowData[i]['start'] - 1 for i in rows],
+                [rowData[i]['end'] for i in rows],
+            )
+        (_, rows, starts, ends) = self._row_bounds
+
+        i = bisect.bisect_right(ends, obj.location.end)
+        if i < len(rows) and starts[i] <= obj.location.start:
+            return rows[i]
         raise Exception("Cannot place feature")
 
-    def featureBox(self, feature, rowData, class_group, row):
+    def featureBox(self, feature, rowData, row):
         x = self.calc_width * (
             feature.location.start - rowData[row]['start']
         ) / self._internal_maxrowlength + self.x_offset
@@ -407,14 +449,9 @@ class Plotter(object):
             10 * ((feature.location.start - 2 * feature.location.strand + 1) % 3) - \
             10 * feature.location.strand
 
-        return self.svg.rect(
-            id=base64.b32encode(get_gff3_id(feature.feature)),
-            insert=(x, y),
-            size=(w, h),
-            style="fill:%s;stroke-width:0.5;" % feature.color,
-        ), x, y, w, h
+        return x, y, w, h
 
-    def featureLabel(self, feature, rowData, class_group, row, label, x, y, w, h):
+    def featureLabel(self, feature, rowData, row, label, x, y, w, h):
         lx = x + w / 2 - len(label) * 4
         lxm = x + (float(w) / 2)
         ly = y + h / 2 + 40
@@ -422,31 +459,28 @@ class Plotter(object):
         if feature.location.strand > 0:
             ly -= 70
 
-        g = self.svg.g(
-            id="%s_g" % base64.b32encode(get_gff3_id(feature.feature)),
-        )
-        g.add(self.svg.text(
-            id='label_text_%s' % base64.b32encode(get_gff3_id(feature.feature)),
-            text=label,
-            x=[lx],
-            y=[ly],
-            style=FONT_STYLE,
-        ))
-
-        if feature.location.strand > 0:
-            callout_start = (lxm, y)
-            callout_end = (lxm, ly)
-        else:
-            callout_start = (lxm, y + h)
-            callout_end = (lxm, ly - h)
+        feature_id = base64.b32encode(get_gff3_id(feature.feature))
+        with self.svg.group(id="%s_g" % feature_id):
+            self.svg.text(
+                label,
+                id='label_text_%s' % feature_id,
+                x=[lx],
+                y=[ly],
+                style=FONT_STYLE,
+            )
 
-        g.add(self.svg.line(
-            id='label_callout_%s' % base64.b32encode(get_gff3_id(feature.feature)),
-            start=callout_start,
-            end=callout_end,
-        ))
+            if feature.location.strand > 0:
+                callout_start = (lxm, y)
+                callout_end = (lxm, ly)
+            else:
+                callout_start = (lxm, y + h)
+                callout_end = (lxm, ly - h)
 
-        return g
+            self.svg.line(
+                id='label_callout_%s' % feature_id,
+                start=callout_start,
+                end=callout_end,
+            )
 
 
 def parseFile(annotations, genome, subset=None, rows=2, width=0, hypo=False):
@@ -463,8 +497,8 @@ def parseFile(annotations, genome, subset=None, rows=2, width=0, hypo=False):
 
         plotter.processSequence(record)
         rowData = plotter.optimizedPartition()
-        svg = plotter.createSvg(rowData, widthOverride=width)
-        print svg.tostring()
+        plotter.createSvg(rowData, sys.stdout, widthOverride=width)
+        sys.stdout.write('\n')
 
 
 if __name__ == '__main__':
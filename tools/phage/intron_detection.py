@@ -7,9 +7,9 @@ import hashlib
 import svgwrite
 import copy
 from BCBio import GFF
-from Bio.Blast import NCBIXML
 from Bio.SeqFeature import SeqFeature, FeatureLocation
 from gff3 import feature_lambda
+from blastxml import read_blastxml
 from collections import OrderedDict
 import logging
 logging.basicConfig(level=logging.DEBUG)
@@ -20,7 +20,7 @@ def parse_xml(blastxml):
     """ Parses xml file to get desired info (genes, hits, etc) """
     blast = []
     discarded_records = 0
-    for iter_num, blast_record in enumerate(NCBIXML.parse(blastxml), 1):
+    for iter_num, blast_record in enumerate(read_blastxml(blastxml), 1):
         blast_gene = []
         for alignment in blast_record.alignments:
             hit_gis = alignment.hit_id + alignment.hit_def
@@ -1,7 +1,13 @@
 #!/usr/bin/env python
 # vim: set fileencoding=utf-8
 import os
+import sys
+import json
+import bisect
 import argparse
+import itertools
+import multiprocessing
+from collections import OrderedDict
 from gff3 import genes, get_gff3_id, get_rbs_from
 from BCBio import GFF
 from Bio import SeqIO
@@ -18,7 +24,31 @@ SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
 def annotation_table_report(record, wanted_cols, gaf_data):
     sorted_features = list(genes(record.features, sort=True))
     if wanted_cols is None or len(wanted_cols.strip()) == 0:
-        return [], []
+        return [], [], []
+
+    # Neighbour index over sorted_features: their starts, and the furthest
+    # end of any feature up to each one.
+    sorted_starts = [x.location.start for x in sorted_features]
+    furthest_ends = []
+    for x in sorted_features:
+        furthest_ends.append(max(furthest_ends[-1:] + [x.location.end]))
+
+    # Sub feature lookups for each feature, shared by every column that
+    # needs them. (SeqFeatures hash by identity.)
+    cds_cache = {}
+    rbs_cache = {}
+
+    def _cdss(feature):
+        """CDSs of a feature, sorted by start"""
+        if feature not in cds_cache:
+            cds_cache[feature] = list(genes(feature.sub_features, feature_type='CDS', sort=True))
+        return cds_cache[feature]
+
+    def _rbss(feature):
+        """RBSs of a feature"""
+        if feature not in rbs_cache:
+            rbs_cache[feature] = get_rbs_from(feature)
+        return rbs_cache[feature]
 
     def rid(record, feature):
         """Organism ID
@@ -53,7 +83,7 @@ def annotation_table_report(record, wanted_cols, gaf_data):
     def length(record, feature):
         """Length (AA)
         """
-        cdss = list(genes(feature.sub_features, feature_type='CDS', sort=True))
+        cdss = _cdss(feature)
         return str(sum([len(cds) for cds in cdss]) / 3)
 
     def notes(record, feature):
@@ -100,13 +130,13 @@ def annotation_table_report(record, wanted_cols, gaf_data):
     def sd_spacing(record, feature):
         """Shine-Dalgarno spacing
         """
-        rbss = get_rbs_from(gene)
+        rbss = _rbss(gene)
         if len(rbss) == 0:
             return 'None'
         else:
             resp = []
+            cdss = _cdss(feature)
             for rbs in rbss:
-                cdss = list(genes(feature.sub_features, feature_type='CDS', sort=True))
 
                 if rbs.location.strand > 0:
                     distance = min(cdss, key=lambda x: x.location.start - rbs.location.end)
@@ -124,13 +154,15 @@ def annotation_table_report(record, wanted_cols, gaf_data):
     def sd_seq(record, feature):
         """Shine-Dalgarno sequence
         """
-        rbss = get_rbs_from(gene)
+        rbss = _rbss(gene)
         if len(rbss) == 0:
             return 'None'
         else:
             resp = []
             for rbs in rbss:
-                resp.append(str(rbs.extract(record).seq))
+                # Extract from the sequence, as slicing the record would
+                # slice all of its features as well.
+                resp.append(str(rbs.extract(record.seq)))
             if len(resp) == 1:
                 return str(resp[0])
             else:
@@ -139,14 +171,14 @@ def annotation_table_report(record, wanted_cols, gaf_data):
     def start_codon(record, feature):
         """Start Codon
         """
-        cdss = list(genes(feature.sub_features, feature_type='CDS', sort=True))
+        cdss = _cdss(feature)
         data = [x for x in cdss]
         if len(data) == 1:
-            return str(data[0].extract(record).seq[0:3])
+            return str(data[0].extract(record.seq)[0:3])
         else:
             return [
                 '{0} ({1.location.start}..{1.location.end}:{1.location.strand})'.format(
-                    x.extract(record).seq[0:3], x
+                    x.extract(record.seq)[0:3], x
                 )
                 for x in data
             ]
@@ -154,7 +186,7 @@ def annotation_table_report(record, wanted_cols, gaf_data):
     def stop_codon(record, feature):
         """Stop Codon
         """
-        return str(feature.extract(record).seq[-3:])
+        return str(feature.extract(record.seq)[-3:])
 
     def dbxrefs(record, feature):
         """DBxrefs
@@ -164,18 +196,17 @@ def annotation_table_report(record, wanted_cols, gaf_data):
     def upstream_feature(record, feature):
         """Next feature upstream"""
         if feature.strand > 0:
-            upstream_features = [x for x in sorted_features
-                                 if x.location.start < feature.location.start]
-            if len(upstream_features) > 0:
-                return upstream_features[-1]
+            # The last feature starting before this one
+            idx = bisect.bisect_left(sorted_starts, feature.location.start)
+            if idx > 0:
+                return sorted_features[idx - 1]
             else:
                 return None
         else:
-            upstream_features = [x for x in sorted_features
-                                 if x.location.end > feature.location.end]
-
-            if len(upstream_features) > 0:
-                return upstream_features[0]
+            # The first feature (in order of start) ending after this one
+            idx = bisect.bisect_right(furthest_ends, feature.location.end)
+            if idx < len(sorted_features):
+                return sorted_features[idx]
             else:
                 return None
 
@@ -281,6 +312,7 @@ def annotation_table_report(record, wanted_cols, gaf_data):
         return _main_gaf_func(record, feature, gaf_data, 'with_or_from')
 
     cols = []
+    keys = []
     data = []
     funcs = []
     lcl = locals()
@@ -298,13 +330,15 @@ def annotation_table_report(record, wanted_cols, gaf_data):
             if len(func_doc) == 1:
                 func_doc += ['']
             cols.append(func_doc)
+            keys.append(x)
         elif '__' in x:
             chosen_funcs = [lcl[y] for y in x.split('__')]
             func_doc = [' of '.join([y.__doc__.strip().split('\n\n')[0] for y in chosen_funcs[::-1]])]
             cols.append(func_doc)
+            keys.append(x)
             funcs.append(chosen_funcs)
 
-    for gene in genes(record.features, sort=True):
+    for gene in sorted_features:
         row = []
         for func in funcs:
             if isinstance(func, list):
@@ -331,7 +365,7 @@ def annotation_table_report(record, wanted_cols, gaf_data):
             row.append(value)
         # print row
         data.append(row)
-    return data, cols
+    return data, cols, keys
 
 
 def parseGafData(file):
@@ -367,23 +401,90 @@ def parseGafData(file):
     return data
 
 
+_RECORDS = None
+_GAF_DATA = None
+
+
+def _init_worker(records, gaf_data):
+    global _RECORDS, _GAF_DATA
+    _RECORDS = records
+    _GAF_DATA = gaf_data
+
+
+def _annotation_table(job):
+    (idx, wanted_cols) = job
+    record = _RECORDS[idx]
+    log.info("Producing an annotation table for %s" % record.id)
+    return annotation_table_report(record, wanted_cols, _GAF_DATA)
+
+
+def annotation_tables(annotations, genome, wanted_cols, gaf_data, threads=1):
+    """Yield (record, data, cols, keys) for each record, in order.
+
+    data is the table's rows, cols the [name, help] of each column and keys
+    the requested column names they came from. Records are processed on a
+    pool of `threads` processes, and yielded as soon as they (and every
+    record before them) are done.
+    """
+    seq_dict = SeqIO.to_dict(SeqIO.parse(genome, "fasta"))
+    # The GFF3 parser reads the whole file before returning any record, so
+    # this costs no extra memory. The workers inherit the records rather
+    # than having each one pickled and sent to them.
+    records = list(GFF.parse(annotations, base_dict=seq_dict))
+    jobs = ((idx, wanted_cols) for idx in range(len(records)))
+
+    if threads > 1:
+        pool = multiprocessing.Pool(threads, _init_worker, (records, gaf_data))
+        results = pool.imap(_annotation_table, jobs)
+    else:
+        pool = None
+        _init_worker(records, gaf_data)
+        results = itertools.imap(_annotation_table, jobs)
+
+    for (record, result) in itertools.izip(records, results):
+        yield (record,) + result
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
+def _tsv_value(value):
+    if isinstance(value, list):
+        return u'"%s"' % u'\n'.join(value)
+    return value
+
+
+def write_tsv(handle, tables):
+    """Write each table as it's produced: a header line then one line per
+    gene, in the same layout as the TSV template"""
+    for (record, data, cols, keys) in tables:
+        handle.write('# ' + ''.join(col[0] + '\t' for col in cols) + '\n')
+        for row in data:
+            line = u''.join(_tsv_value(value) + u'\t' for value in row) + u'\n'
+            handle.write(line.encode('utf-8'))
+
+
+def write_jsonl(handle, tables):
+    """Write one JSON object per gene, keyed by the requested column names"""
+    for (record, data, cols, keys) in tables:
+        for row in data:
+            handle.write(json.dumps(OrderedDict(zip(keys, row))) + '\n')
+
+
 def evaluate_and_report(annotations, genome, reportTemplateName='phage_annotation_validator.html',
-                        annotationTableCols='', gafData=None):
+                        annotationTableCols='', gafData=None, threads=1):
     """
     Generate our HTML evaluation of the genome
     """
-    # Get features from GFF file
-    seq_dict = SeqIO.to_dict(SeqIO.parse(genome, "fasta"))
-    # Get the first GFF3 record
     # TODO: support multiple GFF3 files.
     at_table_data = []
     gaf = {}
     if gafData:
         gaf = parseGafData(gafData)
 
-    for record in GFF.parse(annotations, base_dict=seq_dict):
-        log.info("Producing an annotation table for %s" % record.id)
-        annotation_table_data, annotation_table_col_names = annotation_table_report(record, annotationTableCols, gaf)
+    for (record, annotation_table_data, annotation_table_col_names, _) in \
+            annotation_tables(annotations, genome, annotationTableCols, gaf, threads=threads):
         at_table_data.append((
             record, annotation_table_data
         ))
@@ -408,6 +509,21 @@ def evaluate_and_report(annotations, genome, reportTemplateName='phage_annotatio
     return tpl.render(**kwargs).encode('utf-8')
 
 
+def stream_report(annotations, genome, annotationTableCols='', gafData=None, output_format='tsv', threads=1, **kwargs):
+    """
+    Write the annotation tables as TSV or JSON lines, as they are generated
+    """
+    gaf = {}
+    if gafData:
+        gaf = parseGafData(gafData)
+
+    tables = annotation_tables(annotations, genome, annotationTableCols, gaf, threads=threads)
+    if output_format == 'jsonl':
+        write_jsonl(sys.stdout, tables)
+    else:
+        write_tsv(sys.stdout, tables)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='rebase gff3 features against parent locations', epilog="")
     parser.add_argument('annotations', type=argparse.FileType("r"), help='Parent GFF3 annotations')
@@ -416,7 +532,14 @@ if __name__ == '__main__':
     parser.add_argument('--reportTemplateName', help='Report template file name', default='phageqc_report_full.html')
     parser.add_argument('--annotationTableCols', help='Select columns to report in the annotation table output format')
     parser.add_argument('--gafData', help='CPT GAF-like table', type=argparse.FileType('r'))
+    parser.add_argument('--output_format', choices=['template', 'tsv', 'jsonl'], default='template',
+                        help='Render the report template, or stream a TSV or JSON lines table')
+    parser.add_argument('--threads', type=int, default=1, help='Number of records to process in parallel')
 
     args = parser.parse_args()
 
-    print(evaluate_and_report(**vars(args)))
+    if args.output_format == 'template':
+        del args.output_format
+        print(evaluate_and_report(**vars(args)))
+    else:
+        stream_report(**vars(args))
@@ -1,16 +1,19 @@
 #!/usr/bin/env python
 # vim: set fileencoding=utf-8
 import os
+import re
 import sys
 import json
 import math
-import numpy
+import heapq
 import argparse
 import itertools
 import logging
-from gff3 import feature_lambda, \
+import multiprocessing
+import genome_coverage
+from gff3 import feature_lambda, record_index, \
     coding_genes, genes, get_gff3_id, feature_test_location, get_rbs_from, nice_name
-from shinefind import NaiveSDCaller
+from shinefind import NaiveSDCaller, record_sd_index
 from BCBio import GFF
 from Bio import SeqIO
 from Bio.SeqRecord import SeqRecord
@@ -76,18 +79,20 @@ def missing_rbs(record, lookahead_min=5, lookahead_max=15):
     The returned data is a set of genes with the RBS sequence in the __upstream
     attribute, and a message in the __message attribute.
     """
+    index = record_index(record)
     results = []
     good = 0
     bad = 0
     qc_features = []
     sd_finder = NaiveSDCaller()
+    sd_index = record_sd_index(record, sd_finder=sd_finder)
 
     any_rbss = False
 
-    for gene in coding_genes(record.features):
+    for gene in coding_genes(record.features, index=index):
         # Check if there are RBSs, TODO: make this recursive. Each feature in
         # gene.sub_features can also have sub_features.
-        rbss = get_rbs_from(gene)
+        rbss = get_rbs_from(gene, index=index)
         # No RBS found
         if len(rbss) == 0:
             # Get the sequence lookahead_min to lookahead_max upstream
@@ -102,17 +107,14 @@ def missing_rbs(record, lookahead_min=5, lookahead_max=15):
             # genome, which would be bad.
             (start, end) = __ensure_location_in_bounds(start=start, end=end,
                                                        parent_length=len(record))
-            # Temporary feature to extract sequence
-            tmp = SeqFeature(FeatureLocation(start, end, strand=gene.strand),
-                             type='domain')
             # Get the sequence
-            seq = str(tmp.extract(record.seq))
+            seq = sd_index.sequence(start, end, gene.strand)
             # Set the default properties
             gene.__upstream = seq.lower()
             gene.__message = "No RBS annotated, None found"
 
             # Try and do an automated shinefind call
-            sds = sd_finder.list_sds(seq)
+            sds = sd_index.list_sds(start, end, gene.strand)
             if len(sds) > 0:
                 sd = sds[0]
                 gene.__upstream = sd_finder.highlight_sd(seq.lower(), sd['start'], sd['end'])
@@ -127,7 +129,7 @@ def missing_rbs(record, lookahead_min=5, lookahead_max=15):
                 log.warn("%s RBSs found for gene %s", rbss[0].id, get_gff3_id(gene))
             any_rbss = True
             # get first RBS/CDS
-            cds = list(genes(gene.sub_features, feature_type='CDS'))[0]
+            cds = list(genes(gene.sub_features, feature_type='CDS', index=index))[0]
             rbs = rbss[0]
 
             # Get the distance between the two
@@ -160,7 +162,7 @@ def missing_rbs(record, lookahead_min=5, lookahead_max=15):
 
 
 def require_sd(data, record, chrom_start, sd_min, sd_max):
-    sd_finder = NaiveSDCaller()
+    sd_index = record_sd_index(record)
     for putative_gene in data:
         if putative_gene[2] > 0:  # strand
             start = chrom_start + putative_gene[0] - sd_max
@@ -171,12 +173,7 @@ def require_sd(data, record, chrom_start, sd_min, sd_max):
 
         (start, end) = __ensure_location_in_bounds(start=start, end=end,
                                                    parent_length=len(record))
-        tmp = SeqFeature(FeatureLocation(
-            start, end, strand=putative_gene[2]), type='domain')
-        # Get the sequence
-        seq = str(tmp.extract(record.seq))
-        sds = sd_finder.list_sds(seq)
-        if len(sds) > 0:
+        if len(sd_index.list_sds(start, end, putative_gene[2])) > 0:
             yield putative_gene + (start, end)
 
 
@@ -186,59 +183,44 @@ def excessive_gap(record, excess=50, excess_divergent=200, min_gene=30, slop=30,
 
     Default "excessive" gap size is 10, but that should likely be larger.
     """
+    index = record_index(record)
     results = []
     good = 0
     bad = 0
 
-    contiguous_regions = []
-
-    sorted_genes = sorted(genes(record.features), key=lambda feature: feature.location.start)
+    sorted_genes = sorted(genes(record.features, index=index), key=lambda feature: feature.location.start)
     if len(sorted_genes) == 0:
         log.warn("NO GENES FOUND")
         return good, bad, results, []
 
-    current_gene = None
-    for gene in sorted_genes:
-        # If the gene's start is contiguous to the "current_gene", then we
-        # extend current_gene
-        log.debug('gene.id', gene.id)
-        for cds in genes(gene.sub_features, feature_type='CDS'):
-            log.debug('\t%s %s', cds.id, cds.location)
-            if current_gene is None:
-                current_gene = [
-                    int(cds.location.start),
-                    int(cds.location.end)
-                ]
-
-            if cds.location.start <= current_gene[1] + excess:
-                # Don't want to decrease size
-                if int(cds.location.end) >= current_gene[1]:
-                    current_gene[1] = int(cds.location.end)
-            else:
-                # If it's discontiguous, we append the region and clear.
-                contiguous_regions.append(current_gene)
-                current_gene = [int(cds.location.start), int(cds.location.end)]
-
-    # This generally expected that annotations would NOT continue unto the end
-    # of the genome, however that's a bug, and we can make it here with an
-    # empty contiguous_regions list
-    contiguous_regions.append(current_gene)
-
-    for i in range(len(contiguous_regions) + 1):
-        if i == 0:
-            a = (1, 1)
-            b = contiguous_regions[i]
-        elif i >= len(contiguous_regions):
-            a = contiguous_regions[i - 1]
-            b = (len(record.seq), None)
-        else:
-            a = contiguous_regions[i - 1]
-            b = contiguous_regions[i]
+    cdss = [
+        cds
+        for gene in sorted_genes
+        for cds in genes(gene.sub_features, feature_type='CDS', index=index)
+    ]
+    (starts, ends, _) = genome_coverage.feature_intervals(cdss)
+    depth = genome_coverage.coverage(starts, ends, len(record.seq))
+    covered = genome_coverage.runs(depth > 0)
+    if len(covered) == 0:
+        log.warn("NO CDSs FOUND")
+        return good, bad, results, []
 
-        gap_size = abs(b[0] - a[1])
+    # Stretches of up to `excess` bases between two CDSs are considered part
+    # of one contiguous coding region, anything longer is a gap. The start
+    # and end of the genome are always checked.
+    gap_bounds = [(1, covered[0][0])]
+    gap_bounds += [
+        (gap_start, gap_end)
+        for (gap_start, gap_end) in genome_coverage.gaps(depth, min_length=excess)
+        if gap_start > 0 and gap_end < len(depth)
+    ]
+    gap_bounds.append((covered[-1][1], len(record.seq)))
+
+    for (a_end, b_start) in gap_bounds:
+        gap_size = abs(b_start - a_end)
         if gap_size > min(excess, excess_divergent):
-            a_feat_l = itertools.islice(feature_lambda(sorted_genes, feature_test_location, {'loc': a[1]}, subfeatures=False), 1)
-            b_feat_l = itertools.islice(feature_lambda(sorted_genes, feature_test_location, {'loc': b[0]}, subfeatures=False), 1)
+            a_feat_l = itertools.islice(feature_lambda(sorted_genes, feature_test_location, {'loc': a_end}, subfeatures=False), 1)
+            b_feat_l = itertools.islice(feature_lambda(sorted_genes, feature_test_location, {'loc': b_start}, subfeatures=False), 1)
 
             try:
                 a_feat = next(a_feat_l)
@@ -252,8 +234,8 @@ def excessive_gap(record, excess=50, excess_divergent=200, min_gene=30, slop=30,
                 b_feat = None
 
             result_obj = [
-                a[1],
-                b[0],
+                a_end,
+                b_start,
                 None if not a_feat else a_feat.location.strand,
                 None if not b_feat else b_feat.location.strand
             ]
@@ -350,12 +332,13 @@ def coding_density(record, mean=92.5, sd=20):
     """
     Find coding density in the genome
     """
+    index = record_index(record)
     feature_lengths = 0
 
-    for gene_a in coding_genes(record.features):
+    for gene_a in coding_genes(record.features, index=index):
         feature_lengths += sum([
             len(x) for x in
-            genes(gene_a.sub_features, feature_type='CDS')
+            genes(gene_a.sub_features, feature_type='CDS', index=index)
         ])
 
     avgFeatLen = float(feature_lengths) / float(len(record.seq))
@@ -366,14 +349,41 @@ def exact_coding_density(record, mean=92.5, sd=20):
     """
     Find exact coding density in the genome
     """
-    data = numpy.zeros(len(record.seq))
+    index = record_index(record)
+    cdss = [
+        cds
+        for gene_a in coding_genes(record.features, index=index)
+        for cds in genes(gene_a.sub_features, feature_type='CDS', index=index)
+    ]
+    (starts, ends, _) = genome_coverage.feature_intervals(cdss)
+    # Historically the base following each CDS was counted as well.
+    depth = genome_coverage.coverage(starts, ends + 1, len(record.seq))
+    return genome_coverage.covered_fraction(depth)
+
+
+def overlapping_pairs(intervals):
+    """Find every pair of overlapping half-open intervals.
+
+    Takes a list of (start, end) tuples, and yields (i, j, overlap) for each
+    pair of indices i < j whose intervals share at least one base. This is a
+    sweep over the interval starts, keeping a heap of the intervals which are
+    still open, so only intervals which actually overlap are ever compared.
+    """
+    order = sorted(range(len(intervals)), key=lambda i: intervals[i][0])
+    active = []
+    for i in order:
+        (start, end) = intervals[i]
+        # Anything ending at or before our start can't overlap us, nor any
+        # interval after us.
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
 
-    for gene_a in coding_genes(record.features):
-        for cds in genes(gene_a.sub_features, feature_type='CDS'):
-            for i in range(cds.location.start, cds.location.end + 1):
-                data[i] = 1
+        for (other_end, j) in active:
+            overlap = min(end, other_end) - start
+            if overlap > 0:
+                yield (min(i, j), max(i, j), overlap)
 
-    return float(sum(data)) / len(data)
+        heapq.heappush(active, (end, i))
 
 
 def excessive_overlap(record, excess=15, excess_divergent=30):
@@ -381,54 +391,57 @@ def excessive_overlap(record, excess=15, excess_divergent=30):
     Find excessive overlaps in the genome, where excessive is defined as 15
     bases for same strand, and 30 for divergent translation.
 
-    Does a product of all the top-level features in the genome, and calculates
-    gaps.
+    Sweeps over the CDSs of all coding genes in the genome, and calculates
+    overlaps of those which intersect.
     """
+    index = record_index(record)
     results = []
     bad = 0
     qc_features = []
 
-    for (gene_a, gene_b) in itertools.combinations(coding_genes(record.features), 2):
+    gene_features = list(coding_genes(record.features, index=index))
+    cdss = []
+    for gene in gene_features:
         # Get the CDS from the subfeature list.
-        # TODO: not recursive.
-        cds_a = [x for x in genes(gene_a.sub_features, feature_type='CDS')]
-        cds_b = [x for x in genes(gene_b.sub_features, feature_type='CDS')]
-
-        if len(cds_a) == 0:
-            log.warn("Gene missing subfeatures; %s", get_gff3_id(gene_a))
-            continue
-
-        if len(cds_b) == 0:
-            log.warn("Gene missing subfeatures; %s", get_gff3_id(gene_b))
-            continue
-
-        cds_a = cds_a[0]
-        cds_b = cds_b[0]
-
-        # Set of locations that are included in the CDS of A and the
-        # CDS of B
-        cas = set(range(cds_a.location.start, cds_a.location.end))
-        cbs = set(range(cds_b.location.start, cds_b.location.end))
-
-        # Here we calculate the intersection between the two sets, and
-        # if it's larger than our excessive size, we know that they're
-        # overlapped
-        ix = cas.intersection(cbs)
-
-        if (cds_a.location.strand == cds_b.location.strand and len(ix) >= excess) or \
-                (cds_a.location.strand != cds_b.location.strand and len(ix) >= excess_divergent):
-            bad += float(len(ix)) / float(min(excess, excess_divergent))
+        cds = [x for x in genes(gene.sub_features, feature_type='CDS', index=index)]
+        if len(cds) == 0:
+            log.warn("Gene missing subfeatures; %s", get_gff3_id(gene))
+            cdss.append(None)
+        else:
+            cdss.append(cds[0])
+
+    with_cds = [i for (i, c) in enumerate(cdss) if c is not None]
+    intervals = [
+        (int(cdss[i].location.start), int(cdss[i].location.end))
+        for i in with_cds
+    ]
+
+    # Pairs are reported in the same order a product of all of the genes
+    # would visit them.
+    overlaps = sorted(
+        (with_cds[a], with_cds[b], overlap)
+        for (a, b, overlap) in overlapping_pairs(intervals)
+    )
+    for (a, b, overlap) in overlaps:
+        (cds_a, cds_b) = (cdss[a], cdss[b])
+        if (cds_a.location.strand == cds_b.location.strand and overlap >= excess) or \
+                (cds_a.location.strand != cds_b.location.strand and overlap >= excess_divergent):
+            # First and last base shared by the two CDSs
+            ix_min = max(int(cds_a.location.start), int(cds_b.location.start))
+            ix_max = ix_min + overlap - 1
+
+            bad += float(overlap) / float(min(excess, excess_divergent))
             qc_features.append(gen_qc_feature(
-                min(ix),
-                max(ix),
+                ix_min,
+                ix_max,
                 "Excessive Overlap",
-                id_src=gene_a
+                id_src=gene_features[a]
             ))
-            results.append((gene_a, gene_b, min(ix), max(ix)))
+            results.append((gene_features[a], gene_features[b], ix_min, ix_max))
 
     # Good isn't accurate here. It's a triangle number and just ugly, but we
     # don't care enough to fix it.
-    good = len(list(coding_genes(record.features)))
+    good = len(gene_features)
     good = int(good - bad)
     if good < 0:
         good = 0
@@ -447,6 +460,7 @@ def get_encouragement(score):
 def genome_overview(record):
     """Genome overview
     """
+    index = record_index(record)
     data = {
         'genes': {
             'count': 0,
@@ -470,7 +484,7 @@ def genome_overview(record):
             'gc': 0,
         }
     }
-    gene_features = list(coding_genes(record.features))
+    gene_features = list(coding_genes(record.features, index=index))
     data['genes']['count'] = len(gene_features)
 
     for feat in gene_features:
@@ -493,11 +507,12 @@ def find_morons(record):
 
     TODO: remove? Idk.
     """
+    index = record_index(record)
     results = []
     good = 0
     bad = 0
 
-    gene_features = list(coding_genes(record.features))
+    gene_features = list(coding_genes(record.features, index=index))
     for i, gene in enumerate(gene_features):
         two_left = gene_features[i - 2:i]
         two_right = gene_features[i + 1:i + 1 + 2]
@@ -523,14 +538,15 @@ def find_morons(record):
 def bad_gene_model(record):
     """Find features without product
     """
+    index = record_index(record)
     results = []
     good = 0
     bad = 0
     qc_features = []
 
-    for gene in coding_genes(record.features):
-        exons = [x for x in genes(gene.sub_features, feature_type='exon') if len(x) > 10]
-        CDSs = [x for x in genes(gene.sub_features, feature_type='CDS')]
+    for gene in coding_genes(record.features, index=index):
+        exons = [x for x in genes(gene.sub_features, feature_type='exon', index=index) if len(x) > 10]
+        CDSs = [x for x in genes(gene.sub_features, feature_type='CDS', index=index)]
         if len(exons) >= 1 and len(CDSs) >= 1:
             if len(exons) != len(CDSs):
                 results.append((
@@ -579,14 +595,15 @@ def bad_gene_model(record):
 def weird_starts(record):
     """Find features without product
     """
+    index = record_index(record)
     good = 0
     bad = 0
     qc_features = []
     results = []
 
     overall = {}
-    for gene in coding_genes(record.features):
-        seq = [x for x in genes(gene.sub_features, feature_type='CDS')]
+    for gene in coding_genes(record.features, index=index):
+        seq = [x for x in genes(gene.sub_features, feature_type='CDS', index=index)]
         if len(seq) == 0:
             log.warn("No CDS for gene %s", get_gff3_id(gene))
             continue
@@ -634,12 +651,13 @@ def weird_starts(record):
 def missing_genes(record):
     """Find features without product
     """
+    index = record_index(record)
     results = []
     good = 0
     bad = 0
     qc_features = []
 
-    for gene in coding_genes(record.features):
+    for gene in coding_genes(record.features, index=index):
         if gene.qualifiers.get('cpt_source', [None])[0] == 'CPT_GENE_MODEL_CORRECTION':
             results.append(gene)
             bad += 1
@@ -653,15 +671,16 @@ def gene_model_correction_issues(record):
     """Find features that have issues from the gene model correction step.
     These have qualifiers beginning with CPT_GMS
     """
+    index = record_index(record)
     results = []
     good = 0
     bad = 0
     qc_features = []
 
     # For each gene
-    for gene in coding_genes(record.features):
+    for gene in coding_genes(record.features, index=index):
         # Get the list of child CDSs
-        cdss = [x for x in genes(gene.sub_features, feature_type='CDS')]
+        cdss = [x for x in genes(gene.sub_features, feature_type='CDS', index=index)]
         # And our matching qualifiers
         gene_data = [(k, v) for (k, v) in gene.qualifiers.items() if k == 'cpt_gmc']
         # If there are problems with ONLY the parent, let's complain
@@ -760,13 +779,14 @@ def gene_model_correction_issues(record):
 def missing_tags(record):
     """Find features without product
     """
+    index = record_index(record)
     results = []
     good = 0
     bad = 0
     qc_features = []
 
-    for gene in coding_genes(record.features):
-        cds = [x for x in genes(gene.sub_features, feature_type='CDS')]
+    for gene in coding_genes(record.features, index=index):
+        cds = [x for x in genes(gene.sub_features, feature_type='CDS', index=index)]
         if len(cds) == 0:
             log.warn("Gene missing CDS subfeature %s", get_gff3_id(gene))
             continue
@@ -789,22 +809,15 @@ def missing_tags(record):
     return good, bad, results, qc_features
 
 
-def evaluate_and_report(annotations, genome, gff3=None,
-                        tbl=None, sd_min=5, sd_max=15, min_gene_length=30,
-                        excessive_gap_dist=50, excessive_gap_divergent_dist=200,
-                        excessive_overlap_dist=25, excessive_overlap_divergent_dist=50,
-                        reportTemplateName='phage_annotation_validator.html'):
+def evaluate_record(record, sd_min=5, sd_max=15, min_gene_length=30,
+                    excessive_gap_dist=50, excessive_gap_divergent_dist=200,
+                    excessive_overlap_dist=25, excessive_overlap_divergent_dist=50):
     """
-    Generate our HTML evaluation of the genome
-    """
-    # Get features from GFF file
-    seq_dict = SeqIO.to_dict(SeqIO.parse(genome, "fasta"))
-    # Get the first GFF3 record
-    # TODO: support multiple GFF3 files.
-    record = list(GFF.parse(annotations, base_dict=seq_dict))[0]
+    Run every QC check against a single record.
 
-    gff3_qc_record = SeqRecord(record.id, id=record.id)
-    gff3_qc_record.features = []
+    Returns the data for the report templates, and the QC features for the
+    GFF3 track. The JSON table is a subset of the former.
+    """
     gff3_qc_features = []
 
     log.info("Locating missing RBSs")
@@ -957,18 +970,29 @@ def evaluate_and_report(annotations, genome, gff3=None,
         'coding_density_score': cd,
     }
 
-    with open(tbl, 'w') as handle:
-        kw_subset = {}
-        for key in kwargs:
-            if key in ('score', 'record_name') or '_good' in key or '_bad' in key or '_overall' in key:
-                kw_subset[key] = kwargs[key]
-        json.dump(kw_subset, handle)
+    return kwargs, gff3_qc_features
+
+
+def table_subset(kwargs):
+    """The non-interactive subset of a record's results"""
+    kw_subset = {}
+    for key in kwargs:
+        if key in ('score', 'record_name') or '_good' in key or '_bad' in key or '_overall' in key:
+            kw_subset[key] = kwargs[key]
+    return kw_subset
 
-    with open(gff3, 'w') as handle:
-        gff3_qc_record.features = gff3_qc_features
-        gff3_qc_record.annotations = {}
-        GFF.write([gff3_qc_record], handle)
 
+def write_qc_gff3(record_id, qc_features, handle):
+    gff3_qc_record = SeqRecord(record_id, id=record_id)
+    gff3_qc_record.features = qc_features
+    gff3_qc_record.annotations = {}
+    GFF.write([gff3_qc_record], handle)
+
+
+def render_report(kwargs, reportTemplateName='phage_annotation_validator.html'):
+    """
+    Generate our HTML evaluation of the genome
+    """
     def nice_strand(direction):
         if direction > 0:
             return '→'.decode('utf-8')
@@ -1010,6 +1034,130 @@ def evaluate_and_report(annotations, genome, gff3=None,
     return tpl.render(**kwargs).encode('utf-8')
 
 
+def evaluate_and_report(annotations, genome, gff3=None,
+                        tbl=None, sd_min=5, sd_max=15, min_gene_length=30,
+                        excessive_gap_dist=50, excessive_gap_divergent_dist=200,
+                        excessive_overlap_dist=25, excessive_overlap_divergent_dist=50,
+                        reportTemplateName='phage_annotation_validator.html',
+                        batch_dir=None, threads=1):
+    """
+    Generate our HTML evaluation of the genome
+
+    By default only the first record is evaluated. With a batch_dir, every
+    record is evaluated (see evaluate_batch) and a summary table is returned
+    instead of the HTML report.
+    """
+    check_kwargs = {
+        'sd_min': sd_min,
+        'sd_max': sd_max,
+        'min_gene_length': min_gene_length,
+        'excessive_gap_dist': excessive_gap_dist,
+        'excessive_gap_divergent_dist': excessive_gap_divergent_dist,
+        'excessive_overlap_dist': excessive_overlap_dist,
+        'excessive_overlap_divergent_dist': excessive_overlap_divergent_dist,
+    }
+    # Get features from GFF file
+    seq_dict = SeqIO.to_dict(SeqIO.parse(genome, "fasta"))
+
+    if batch_dir is not None:
+        records = GFF.parse(annotations, base_dict=seq_dict)
+        return evaluate_batch(records, batch_dir, check_kwargs,
+                              reportTemplateName=reportTemplateName,
+                              threads=threads)
+
+    # Get the first GFF3 record
+    record = next(GFF.parse(annotations, base_dict=seq_dict))
+    kwargs, gff3_qc_features = evaluate_record(record, **check_kwargs)
+
+    with open(tbl, 'w') as handle:
+        json.dump(table_subset(kwargs), handle)
+
+    with open(gff3, 'w') as handle:
+        write_qc_gff3(record.id, gff3_qc_features, handle)
+
+    return render_report(kwargs, reportTemplateName=reportTemplateName)
+
+
+SUMMARY_CHECKS = (
+    'missing_rbs', 'excessive_gap', 'excessive_overlap', 'morons',
+    'missing_tags', 'missing_genes', 'weird_starts', 'gene_model',
+    'gene_model_correction',
+)
+
+
+def _batch_file_name(index, record_id):
+    """File name (without extension) for a record's batch outputs.
+
+    Record IDs may contain path separators, or only differ in characters
+    which aren't safe in a file name, so the ID is sanitised and prefixed
+    with the record's position in the input to keep every name unique and
+    inside the batch directory.
+    """
+    return '%d_%s' % (index + 1, re.sub('[^A-Za-z0-9_.-]', '_', record_id))
+
+
+def _evaluate_batch_record(job):
+    """Evaluate one record and write its report, JSON and GFF3 to disk.
+
+    Module level so that it can be sent to a process pool; only the summary
+    row goes back to the parent.
+    """
+    (index, record, batch_dir, check_kwargs, reportTemplateName) = job
+    kwargs, gff3_qc_features = evaluate_record(record, **check_kwargs)
+
+    file_name = _batch_file_name(index, record.id)
+    name = os.path.join(batch_dir, file_name)
+    with open(name + '.json', 'w') as handle:
+        json.dump(table_subset(kwargs), handle)
+
+    with open(name + '.gff3', 'w') as handle:
+        write_qc_gff3(record.id, gff3_qc_features, handle)
+
+    with open(name + os.path.splitext(reportTemplateName)[1], 'w') as handle:
+        handle.write(render_report(kwargs, reportTemplateName=reportTemplateName))
+
+    row = [record.id, file_name, kwargs['score'], kwargs['coding_density']]
+    for check in SUMMARY_CHECKS:
+        row += [kwargs[check + '_good'], kwargs[check + '_bad']]
+    return row
+
+
+def evaluate_batch(records, batch_dir, check_kwargs,
+                   reportTemplateName='phage_annotation_validator.html',
+                   threads=1):
+    """
+    Evaluate every record, writing a report, JSON table and QC GFF3 track per
+    record into batch_dir (named as in _batch_file_name). Records are spread
+    over a pool of `threads` processes.
+
+    Returns a TSV summary table with one row per record, in input order.
+    """
+    if not os.path.exists(batch_dir):
+        os.makedirs(batch_dir)
+
+    jobs = ((index, record, batch_dir, check_kwargs, reportTemplateName)
+            for (index, record) in enumerate(records))
+    if threads > 1:
+        pool = multiprocessing.Pool(threads)
+        rows = pool.imap(_evaluate_batch_record, jobs)
+    else:
+        pool = None
+        rows = itertools.imap(_evaluate_batch_record, jobs)
+
+    header = ['record', 'file', 'score', 'coding_density']
+    for check in SUMMARY_CHECKS:
+        header += [check + '_good', check + '_bad']
+
+    table = ['\t'.join(header)]
+    for row in rows:
+        table.append('\t'.join(map(str, row)))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return '\n'.join(table) + '\n'
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='rebase gff3 features against parent locations', epilog="")
     parser.add_argument('annotations', type=argparse.FileType("r"), help='Parent GFF3 annotations')
@@ -1030,6 +1178,9 @@ if __name__ == '__main__':
 
     parser.add_argument('--reportTemplateName', help='Report template file name', default='phageqc_report_full.html')
 
+    parser.add_argument('--batch_dir', help='Validate every record, writing per-record results to this directory and a summary table to stdout')
+    parser.add_argument('--threads', type=int, help='Number of records to validate in parallel in batch mode', default=1)
+
     args = parser.parse_args()
 
     sys.stdout.write(evaluate_and_report(**vars(args)))
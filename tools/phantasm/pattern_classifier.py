@@ -0,0 +1 @@
+../gff3/pattern_classifier.py
\ No newline at end of file
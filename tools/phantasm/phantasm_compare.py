@@ -1,36 +1,98 @@
 #!/usr/bin/env python
 import argparse
+import itertools
+import StringIO
+import numpy
+
+
+def _seekable(handle):
+    try:
+        handle.seek(0, 1)
+        return True
+    except (AttributeError, IOError, OSError):
+        return False
+
+
+def read_comparison(handle):
+    """Read a two-way comparison from phantasm_data_comparison.
+
+    Either the three column table, or the .npy output (IDs of A, IDs of B,
+    then the matrix of values). Returns (ids_a, ids_b, rows, cols, scores),
+    where each score is for the pair (ids_a[rows], ids_b[cols]). rows,
+    cols and scores may be (broadcastable) index arrays.
+
+    The handle needn't be seekable (e.g. a pipe). The format is sniffed from
+    the first few bytes, which are then put back in front of the rest; an
+    .npy from a pipe is read into memory first, as numpy.load needs to seek.
+    """
+    magic = handle.read(len(numpy.lib.format.MAGIC_PREFIX))
+    if magic == numpy.lib.format.MAGIC_PREFIX:
+        if _seekable(handle):
+            handle.seek(0)
+        else:
+            handle = StringIO.StringIO(magic + handle.read())
+        ids_a = numpy.load(handle).tolist()
+        ids_b = numpy.load(handle).tolist()
+        scores = numpy.load(handle)
+        return (ids_a, ids_b, numpy.arange(len(ids_a))[:, numpy.newaxis],
+                numpy.arange(len(ids_b))[numpy.newaxis, :], scores)
+
+    # The sniffed bytes may hold the start of a line, or a short line or two
+    lines = itertools.chain((magic + handle.readline()).splitlines(True), handle)
+
+    index_a = {}
+    index_b = {}
+    rows = []
+    cols = []
+    scores = []
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        (a, b, score) = line.strip().split('\t')
+        rows.append(index_a.setdefault(a, len(index_a)))
+        cols.append(index_b.setdefault(b, len(index_b)))
+        scores.append(float(score))
+
+    ids_a = sorted(index_a, key=index_a.get)
+    ids_b = sorted(index_b, key=index_b.get)
+    return (ids_a, ids_b, numpy.array(rows, dtype=numpy.int64),
+            numpy.array(cols, dtype=numpy.int64), numpy.array(scores))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='PHAnTASM Comparison Mapper')
     parser.add_argument('--files', type=argparse.FileType("r"), nargs="+", help='Input Two-Way Comparison')
     parser.add_argument('--weights', type=float, nargs="+", help="Metric Weighting")
-    parser.add_argument('--version', action='version', version='0.2')
+    parser.add_argument('--version', action='version', version='0.4')
     args = parser.parse_args()
 
     if len(args.files) != len(args.weights):
         raise Exception("Must specifiy same number of files and metric_weights")
 
-    result_map = {}
     weight_sums = sum(args.weights)
+    comparisons = [read_comparison(f) for f in args.files]
+
+    # Only the "from" genomes are reported, against each other
+    keys = sorted(set(a for comparison in comparisons for a in comparison[0]))
+    key_index = dict((key, i) for (i, key) in enumerate(keys))
+    result = numpy.zeros((len(keys), len(keys)))
+    scored = numpy.zeros((len(keys), len(keys)), dtype=bool)
+
+    for (ids_a, ids_b, rows, cols, scores), m in zip(comparisons, args.weights):
+        index_a = numpy.array([key_index[a] for a in ids_a], dtype=numpy.int64)
+        index_b = numpy.array([key_index.get(b, -1) for b in ids_b], dtype=numpy.int64)
+        (rows, cols) = (index_a[rows], index_b[cols])
+        (rows, cols, scores) = numpy.broadcast_arrays(rows, cols, scores)
+        kept = cols != -1
 
-    for f, m in zip(args.files, args.weights):
-        data = [x.strip().split('\t') for x in f.readlines() if not
-                x.startswith('#')]
-        for (a, b, score) in data:
-            if a not in result_map:
-                result_map[a] = {}
-            if b not in result_map[a]:
-                result_map[a][b] = 0
+        numpy.add.at(result, (rows[kept], cols[kept]), scores[kept] * m / weight_sums)
+        scored[rows[kept], cols[kept]] = True
 
-            result_map[a][b] += (float(score) * m / weight_sums)
+    if not scored.all():
+        (f, t) = numpy.argwhere(~scored)[0]
+        raise Exception("No score for %s against %s" % (keys[f], keys[t]))
 
-    keys = sorted(result_map.keys())
     # Header
     print '\t'.join([''] + keys)
-    for f in keys:
-        current_row = [f]
-        for t in keys:
-            current_row.extend([result_map[f][t]])
-        print '\t'.join(current_row)
+    for f, row in zip(keys, result.tolist()):
+        print '\t'.join([f] + map(str, row))
@@ -1,80 +1,199 @@
 #!/usr/bin/env python
 import argparse
+import itertools
+import multiprocessing
+import sys
+import numpy
 import Levenshtein
 from phantasm import Cassettes, Utils
 import logging
 logging.basicConfig(level=logging.INFO)
 
+# Comparisons are computed for blocks of rows of A against all of B, with
+# about this many values per block.
+BLOCK_SIZE = 1 << 20
 
-def compare_values(a, b, method, undef_value):
-    if method not in ('phantasm_cids', 'texteq', 'levenshtein'):
-        # Methods listed above use strings, so we can ignore those.
-        #
-        # If we can't convert to float, then we just exit early and return our
-        # undefined value
-        try:
-            a = float(a)
-        except:
-            return undef_value
+NUMERIC_METHODS = {
+    'add': lambda a, b: a + b,
+    'sub': lambda a, b: a - b,
+    'mult': lambda a, b: a * b,
+    'div': lambda a, b: a / b,
+    'dist': lambda a, b: numpy.abs(a - b),
+    'pdiff': lambda a, b: numpy.abs(a - b) / (a + b),
+    'numeq': lambda a, b: (a == b).astype(numpy.int64),
+}
+
+# Number of set bits in each byte value
+POPCOUNT = numpy.array([bin(i).count("1") for i in range(256)], dtype=numpy.int64)
+
+
+def parse_floats(values):
+    """Values as a float array, and a mask of those which are numbers"""
+    parsed = numpy.zeros(len(values), dtype=numpy.float64)
+    valid = numpy.zeros(len(values), dtype=bool)
+    for i, value in enumerate(values):
         try:
-            b = float(b)
-        except:
-            return undef_value
-
-    if method == 'add':
-        return a + b
-    elif method == 'sub':
-        return a - b
-    elif method == 'mult':
-        return a * b
-    elif method == 'div':
-        if b == 0:
-            return undef_value
+            parsed[i] = float(value)
+            valid[i] = True
+        except (TypeError, ValueError):
+            pass
+    return parsed, valid
+
+
+def compare_numeric(a, valid_a, b, valid_b, method):
+    """Compare every value in a with every value in b.
+
+    Returns the len(a) x len(b) matrix of results, and a mask of those
+    which are undefined (either value isn't a number, or the result is a
+    division by zero).
+    """
+    a = a[:, numpy.newaxis]
+    b = b[numpy.newaxis, :]
+    undefined = ~(valid_a[:, numpy.newaxis] & valid_b[numpy.newaxis, :])
+
+    with numpy.errstate(all='ignore'):
+        if method == 'bit_diff':
+            # Values are truncated to integers, which must fit in 64 bits
+            undefined = undefined | ~numpy.isfinite(a) | ~numpy.isfinite(b)
+            a = numpy.abs(numpy.where(numpy.isfinite(a), a, 0).astype(numpy.int64))
+            b = numpy.abs(numpy.where(numpy.isfinite(b), b, 0).astype(numpy.int64))
+            xor = numpy.bitwise_xor(a, b)
+            values = POPCOUNT[xor[..., numpy.newaxis].view(numpy.uint8)].sum(axis=-1)
         else:
-            return a / b
-    elif method == 'dist':
-        return abs(a - b)
-    elif method == 'pdiff':
-        return abs(a - b) / (a + b)
-    elif method == 'bit_diff':
-        a = abs(int(a))
-        b = abs(int(b))
-        return bin(a ^ b).count("1")
-    elif method == 'phantasm_cids':
-        chunked = Cassettes.revcomrot(a)
-        # Compare each for levenshtein distance, return the minimum
-        scores = [abs(Levenshtein.distance(x, b)) for x in chunked]
-        return min(scores)
-    elif method == 'numeq':
-        return 1 if a == b else 0
-    elif method == 'texteq':
-        a = a.strip()
-        b = b.strip()
+            values = NUMERIC_METHODS[method](a, b)
+            if method == 'div':
+                undefined = undefined | (b == 0)
+            elif method == 'pdiff':
+                undefined = undefined | (a + b == 0)
+
+    return values, numpy.broadcast_to(undefined, values.shape)
+
+
+def text_codes(values_a, values_b):
+    """An integer for each stripped value of A and of B, equal for equal text
+    (in either). Empty values are -1."""
+    codes = {'': -1}
+    coded = numpy.array([codes.setdefault(value.strip(), len(codes) - 1)
+                         for value in itertools.chain(values_a, values_b)], dtype=numpy.int64)
+    return coded[:len(values_a)], coded[len(values_a):]
+
+
+_VALUES_B = None
+
+
+def _init_strings(values_b):
+    global _VALUES_B
+    _VALUES_B = values_b
 
-        if a is None or b is None:
-            return 0
-        elif len(a) == 0 or len(b) == 0:
-            return 0
+
+def _compare_strings(job):
+    """Levenshtein distances (phantasm_cids or levenshtein) for some rows of
+    A against all of B"""
+    (method, rows) = job
+    values = []
+    for a in rows:
+        if method == 'phantasm_cids':
+            # Compare each rotation for levenshtein distance, keep the minimum
+            chunked = Cassettes.revcomrot(a)
+            values.append([min(abs(Levenshtein.distance(x, b)) for x in chunked)
+                           for b in _VALUES_B])
+        else:
+            values.append([Levenshtein.distance(a, b) for b in _VALUES_B])
+    return numpy.array(values, dtype=numpy.int64).reshape(len(rows), len(_VALUES_B))
+
+
+def compare_blocks(values_a, values_b, method, threads=1):
+    """Compare every value in A with every value in B, a block of rows of A
+    at a time.
+
+    Yields (values, undefined) for consecutive blocks of rows; values is
+    the block of results and undefined masks those which should be
+    replaced by the undefined value. Numeric methods are computed with
+    numpy. Levenshtein distances are computed on a pool of `threads`
+    processes.
+    """
+    rows = max(BLOCK_SIZE // max(len(values_b), 1), 1)
+    starts = range(0, len(values_a), rows)
+
+    if method in ('phantasm_cids', 'levenshtein'):
+        jobs = ((method, values_a[i:i + rows]) for i in starts)
+        if threads > 1:
+            pool = multiprocessing.Pool(threads, _init_strings, (values_b,))
+            results = pool.imap(_compare_strings, jobs)
         else:
-            return 1 if a == b else 0
-    elif method == 'levenshtein':
-        return Levenshtein.distance(a, b)
+            pool = None
+            _init_strings(values_b)
+            results = itertools.imap(_compare_strings, jobs)
+
+        for values in results:
+            yield values, numpy.zeros(values.shape, dtype=bool)
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+    elif method == 'texteq':
+        (codes_a, codes_b) = text_codes(values_a, values_b)
+        codes_b = codes_b[numpy.newaxis, :]
+        for i in starts:
+            block = codes_a[i:i + rows, numpy.newaxis]
+            values = ((block == codes_b) & (block != -1)).astype(numpy.int64)
+            yield values, numpy.zeros(values.shape, dtype=bool)
     else:
-        raise NotImplementedError("Comparison method %s not available" % method)
-    return None
+        (a, valid_a) = parse_floats(values_a)
+        (b, valid_b) = parse_floats(values_b)
+        for i in starts:
+            yield compare_numeric(a[i:i + rows], valid_a[i:i + rows], b, valid_b, method)
+
+
+def write_tabular(out, ids_a, ids_b, blocks, undef_value):
+    """Write (ID_A, ID_B, Value) rows, all of B for each row of A"""
+    out.write('\t'.join(['# ID_A', 'ID_B', 'Value']) + '\n')
+    undef_text = str(undef_value)
+    ids_a = iter(ids_a)
+    for (values, undefined) in blocks:
+        for (row, row_undefined) in zip(values.tolist(), undefined):
+            id_a = str(next(ids_a))
+            cells = map(str, row)
+            for j in numpy.flatnonzero(row_undefined):
+                cells[j] = undef_text
+            out.write(''.join('%s\t%s\t%s\n' % (id_a, id_b, cell)
+                              for (id_b, cell) in zip(ids_b, cells)))
+
 
+def write_npy(out, ids_a, ids_b, blocks, undef_value):
+    """Write three .npy arrays, one after the other: the IDs of A, the IDs
+    of B, and the len(A) x len(B) float64 matrix of values.
 
-def compare_files(file_a, file_b, comparison_method, undef_value, **kwargs):
+    The matrix is written as it's computed, a block of rows at a time.
+    Read them back by calling numpy.load three times on the same handle.
+    """
+    numpy.lib.format.write_array(out, numpy.array(ids_a, dtype=str))
+    numpy.lib.format.write_array(out, numpy.array(ids_b, dtype=str))
+
+    dtype = numpy.dtype('<f8')
+    numpy.lib.format.write_array_header_1_0(out, {
+        'descr': numpy.lib.format.dtype_to_descr(dtype),
+        'fortran_order': False,
+        'shape': (len(ids_a), len(ids_b)),
+    })
+    for (values, undefined) in blocks:
+        values = values.astype(dtype)
+        values[undefined] = undef_value
+        out.write(values.tobytes())
+
+
+def compare_files(file_a, file_b, comparison_method, undef_value, output_format='tabular', threads=1, **kwargs):
     (header_a, data_a) = Utils.load_data_with_headers(file_a)
     (header_b, data_b) = Utils.load_data_with_headers(file_b)
 
-    header = ['# ID_A', 'ID_B', 'Value']
-    yield header
+    ids_b = [str(row[0]) for row in data_b]
+    blocks = compare_blocks([row[1] for row in data_a], [row[1] for row in data_b],
+                            comparison_method, threads=threads)
 
-    for row_a in data_a:
-        for row_b in data_b:
-            yield (row_a[0], row_b[0],
-                   compare_values(row_a[1], row_b[1], comparison_method, undef_value))
+    if output_format == 'npy':
+        write_npy(sys.stdout, [str(row[0]) for row in data_a], ids_b, blocks, undef_value)
+    else:
+        write_tabular(sys.stdout, [row[0] for row in data_a], ids_b, blocks, undef_value)
 
 
 if __name__ == '__main__':
@@ -88,8 +207,11 @@ if __name__ == '__main__':
     parser.add_argument('undef_value', nargs='?', type=float, default=0,
                         help='Undefined value. For operations involving division, ' +
                         'what should undefined results be set to? (e.g. 3/0 = ?).')
-    parser.add_argument('--version', action='version', version='0.1')
+    parser.add_argument('--output_format', choices=['tabular', 'npy'], default='tabular',
+                        help='Three column table, or a binary matrix for phantasm_compare')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='Number of processes computing string comparisons')
+    parser.add_argument('--version', action='version', version='0.3')
     args = parser.parse_args()
 
-    for row in compare_files(**vars(args)):
-        print '\t'.join(map(str, row))
+    compare_files(**vars(args))
@@ -4,6 +4,7 @@ from Bio import SeqIO
 import re
 import argparse
 from phantasm import Cassettes
+from pattern_classifier import PatternClassifier
 
 
 if __name__ == '__main__':
@@ -32,44 +33,34 @@ if __name__ == '__main__':
                               cassette_model[key]['custom'][custom]['isnot']],
                 }
 
+    # The last member (in regex_containers' order) to match wins, found
+    # with one combined regex; products recur, so each is only matched once.
+    classifier = PatternClassifier(
+        [(regex, regex_containers[regex]['parent']) for regex in regex_containers],
+        flags=re.IGNORECASE, anchored=True
+    )
+    cassette_ids = {}
+
     print "\t".join(["#ID", "CID"])
     for i, record in enumerate(SeqIO.parse(args.genbank_file, "genbank")):
         data = ''
         for feature in [x for x in record.features if x.type == 'CDS' and
                         'product' in x.qualifiers]:
-            matched_result = None
             feature_result = ''.join(feature.qualifiers['product'])
+            if feature_result not in cassette_ids:
+                matched_result = classifier.classify(feature_result)
 
-            for regex in regex_containers:
-                if regex_containers[regex]['re'].match(feature_result):
-                    matched_result = regex_containers[regex]['parent']
-
-            for custom in custom_regexes:
-                care = False
-                # If we hit to an is-statement, we care
-                for regex in custom_regexes[custom]['is']:
-                    if regex.match(feature_result):
-                        care = True
-                # As long as we don't hit to an isnot-statement
-                for regex in custom_regexes[custom]['isnot']:
-                    if regex.match(feature_result):
-                        care = False
-
-                if care:
-                    is_okay = True
-                    ok_to_overwrite = True
-
-                    for regex in custom_regexes[custom]['is']:
-                        if not regex.match(feature_result):
-                            is_okay = False
-
-                    for regex in custom_regexes[custom]['isnot']:
-                        if regex.match(feature_result):
-                            ok_to_overwrite = False
-                            is_okay = False
+                for custom in custom_regexes:
+                    # If we hit to every is-statement, and to no
+                    # isnot-statement, we overwrite
+                    rule = custom_regexes[custom]
+                    if rule['is'] and \
+                            all(regex.match(feature_result) for regex in rule['is']) and \
+                            not any(regex.match(feature_result) for regex in rule['isnot']):
+                        matched_result = rule['title']
 
-                    if is_okay and ok_to_overwrite:
-                        matched_result = custom_regexes[custom]['title']
+                cassette_ids[feature_result] = matched_result
+            matched_result = cassette_ids[feature_result]
 
             if matched_result is not None:
                 if feature.location.strand > 0:
@@ -1,11 +1,19 @@
 #!/usr/bin/env python
 import sys
 import argparse
+import numpy
 
+# Traceback directions
+STOP, DIAG, UP, LEFT = 0, 1, 2, 3
 
-class MSA:
+
+class MSA(object):
     """
     multiple item alignment
+
+    Items are interned as integer IDs. The merger is kept as an integer
+    (rows x aligned lists) array, and only turned back into lists of items
+    when it's read.
     """
     def __init__(self, bidi=True, gap=0, match=5, mismatch=-1):
         self.sequences = []
@@ -15,18 +23,47 @@ class MSA:
         self.match_score = match
         self.mismatch_score = mismatch
 
-        self.merger = []
+        # Item <-> ID, and each ID's related IDs in either direction
+        self._ids = {}
+        self._items = []
+        self._related = {}
+
         self.number_of_aligned_lists = 0
+        self.merger = []
+
+    def _id(self, item):
+        if item not in self._ids:
+            self._ids[item] = len(self._items)
+            self._items.append(item)
+        return self._ids[item]
+
+    @property
+    def merger(self):
+        if self._merger is None:
+            items = self._items
+            self._merger = [[items[x] for x in row] for row in self._merger_ids.tolist()]
+        return self._merger
+
+    @merger.setter
+    def merger(self, rows):
+        ids = [[self._id(x) for x in row] for row in rows]
+        self._merger_ids = numpy.array(ids, dtype=numpy.int64).reshape(len(ids), self.number_of_aligned_lists)
+        self._merger = None
 
     def add_relationship(self, a, b):
         if a not in self.relationships:
-            self.relationships[a] = []
-        self.relationships[a].append(b)
+            self.relationships[a] = set()
+        self.relationships[a].add(b)
 
         if self.bidi:
             if b not in self.relationships:
-                self.relationships[b] = []
-            self.relationships[b].append(a)
+                self.relationships[b] = set()
+            self.relationships[b].add(a)
+
+        # Sij matches in either direction, bidi or not
+        (a, b) = (self._id(a), self._id(b))
+        self._related.setdefault(a, set()).add(b)
+        self._related.setdefault(b, set()).add(a)
 
     def Sij(self, merger_row, query):
         for elem in merger_row:
@@ -35,6 +72,31 @@ class MSA:
                 return self.match_score
         return self.mismatch_score
 
+    def similarity_matrix(self, data):
+        """Boolean (merger rows x data) matrix, True where Sij would score a
+        match.
+
+        Only the merger cells holding an item related to something in data
+        are found (with one vectorized lookup), and marked against the
+        columns of the items they relate to.
+        """
+        similar = numpy.zeros((self._merger_ids.shape[0], len(data)), dtype=bool)
+
+        # related ID -> columns of data it relates to
+        columns = {}
+        for (j, query) in enumerate(data):
+            for elem in self._related.get(self._ids.get(query), ()):
+                columns.setdefault(elem, []).append(j)
+        if not columns or similar.size == 0:
+            return similar
+
+        flat = self._merger_ids.ravel()
+        hits = numpy.flatnonzero(numpy.in1d(flat, list(columns)))
+        width = self._merger_ids.shape[1]
+        for (row, elem) in zip((hits // width).tolist(), flat[hits].tolist()):
+            similar[row, columns[elem]] = True
+        return similar
+
     def align_list(self, data):
         # If we haven't aligned any lists, we do something special
         if self.number_of_aligned_lists == 0:
@@ -45,77 +107,94 @@ class MSA:
             self.find_best_path(data)
             self.number_of_aligned_lists += 1
 
+    def _sweep(self, pair_score):
+        """Score the DP a line at a time, along the first axis of pair_score.
+
+        Yields the diagonal, previous line and same line move scores of each
+        cell in the line. Moves from the previous line only depend on the
+        last line's scores. A run of moves along the line adds gap per step,
+        so once those steps are taken out the best of everything before a
+        cell is a running maximum. Only the last line of scores is kept.
+        """
+        gap = self.gap_penalty
+        gaps = gap * numpy.arange(pair_score.shape[1] + 1, dtype=numpy.int64)
+
+        line = numpy.full(pair_score.shape[1] + 1, gap, dtype=numpy.int64)
+        line[0] = 0
+        for pair_line in pair_score:
+            diag_score = line[:-1] + pair_line
+            across_score = line[1:] + gap
+
+            line = numpy.empty_like(line)
+            line[0] = gap
+            line[1:] = numpy.maximum(diag_score, across_score) - gaps[1:]
+            line = numpy.maximum.accumulate(line) + gaps
+            yield diag_score, across_score, line[:-1] + gap
+
     def find_best_path(self, data):
-        max_i = len(self.merger)
+        max_i = self._merger_ids.shape[0]
         max_j = len(data)
 
-        score_mat = {}
-        point_mat = {}
-
-        point_mat[(0, 0)] = 'Z'
-        score_mat[(0, 0)] = 0
-
-        for i in range(max_i):
-            point_mat[(i + 1, 0)] = 'U'
-            score_mat[(i + 1, 0)] = self.gap_penalty
-
-        for i in range(max_j):
-            point_mat[(0, i + 1)] = 'L'
-            score_mat[(0, i + 1)] = self.gap_penalty
-
-        # Score
-        for i in range(max_i):
-            ci = self.merger[i]
-            for j in range(max_j):
-                cj = data[j]
-                # scoring
-                diag_score = score_mat[(i, j)] + self.Sij(ci, cj)
-                up_score = score_mat[(i, j + 1)] + self.gap_penalty
-                left_score = score_mat[(i + 1, j)] + self.gap_penalty
-
-                pos = (i + 1, j + 1)
-                if diag_score >= up_score:
-                    if diag_score >= left_score:
-                        score_mat[pos] = diag_score
-                        point_mat[pos] = 'D'
-                    else:
-                        score_mat[pos] = left_score
-                        point_mat[pos] = 'L'
-                else:
-                    if up_score >= left_score:
-                        score_mat[pos] = up_score
-                        point_mat[pos] = 'U'
-                    else:
-                        score_mat[pos] = left_score
-                        point_mat[pos] = 'L'
-
-        # self.print2dArray(score_mat, data)
-        # self.print2dArray(point_mat, data)
-
-        new_row_set = []
+        pair_score = numpy.where(self.similarity_matrix(data), self.match_score, self.mismatch_score)
+
+        def pointers(diag_score, up_score, left_score):
+            # Ties prefer the diagonal, then up
+            return numpy.where(
+                (diag_score >= up_score) & (diag_score >= left_score), DIAG,
+                numpy.where((up_score > diag_score) & (up_score >= left_score), UP, LEFT))
+
+        point_mat = numpy.empty((max_i + 1, max_j + 1), dtype=numpy.int8)
+        point_mat[0, 0] = STOP
+        point_mat[1:, 0] = UP
+        point_mat[0, 1:] = LEFT
+
+        # Sweep along the shorter side, with vectors along the longer one
+        if max_i >= max_j:
+            for j, (diag_score, left_score, up_score) in enumerate(self._sweep(pair_score.T)):
+                point_mat[1:, j + 1] = pointers(diag_score, up_score, left_score)
+        else:
+            for i, (diag_score, up_score, left_score) in enumerate(self._sweep(pair_score)):
+                point_mat[i + 1, 1:] = pointers(diag_score, up_score, left_score)
+
+        # Trace back the merger row (or -1 for a gap) and data item (or -1)
+        # of each new row, then build the new merger in one go
+        from_merger = []
+        from_data = []
+        # Indexing bytes is much cheaper than indexing the array per step
+        points = bytearray(point_mat.tobytes())
+        width = max_j + 1
         i = max_i + 0
         j = max_j + 0
         while True:
             if i == 0 and j == 0:
                 break
 
-            d = point_mat[(i, j)]
-            new_row = None
-            if d == 'D':
-                new_row = self.merger[i - 1] + [data[j - 1]]
+            d = points[i * width + j]
+            if d == DIAG:
+                from_merger.append(i - 1)
+                from_data.append(j - 1)
                 i -= 1
                 j -= 1
-            elif d == 'L':
-                new_row = ['-' for _ in range(self.number_of_aligned_lists)]
-                new_row.append(data[j - 1])
+            elif d == LEFT:
+                from_merger.append(-1)
+                from_data.append(j - 1)
                 j -= 1
-            elif d == 'U':
-                new_row = self.merger[i - 1] + ['-']
+            elif d == UP:
+                from_merger.append(i - 1)
+                from_data.append(-1)
                 i -= 1
 
-            new_row_set.append(new_row)
-
-        self.merger = new_row_set[::-1]
+        from_merger = numpy.array(from_merger[::-1], dtype=numpy.int64)
+        from_data = numpy.array(from_data[::-1], dtype=numpy.int64)
+        gap = self._id('-')
+        data_ids = numpy.array([self._id(x) for x in data] + [gap], dtype=numpy.int64)
+
+        merged = numpy.full((len(from_merger), self.number_of_aligned_lists + 1), gap, dtype=numpy.int64)
+        in_merger = from_merger >= 0
+        merged[in_merger, :-1] = self._merger_ids[from_merger[in_merger]]
+        merged[:, -1] = data_ids[from_data]
+        self._merger_ids = merged
+        self._merger = None
 
     def print2dArray(self, d, xlab=None):
         k = d.keys()
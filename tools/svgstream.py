@@ -0,0 +1,122 @@
+"""
+Streaming SVG output, shared by the plotting tools.
+
+svgwrite builds the whole document as a tree of element objects and only
+serialises it at the end. Here each element is written to the output handle
+as soon as it's added, so memory use doesn't grow with the number of
+features plotted. Attributes are written as svgwrite would (sorted, with
+underscores as hyphens, lists space separated, numbers through str()), so
+the two produce the same markup for the same elements (other than empty
+groups, written here with a closing tag).
+"""
+import contextlib
+from xml.sax.saxutils import escape
+
+SVG_NAMESPACES = [
+    ('baseProfile', 'full'),
+    ('version', '1.1'),
+    ('xmlns', 'http://www.w3.org/2000/svg'),
+    ('xmlns:ev', 'http://www.w3.org/2001/xml-events'),
+    ('xmlns:xlink', 'http://www.w3.org/1999/xlink'),
+]
+
+
+def _value(value):
+    if isinstance(value, (list, tuple)):
+        return ' '.join(map(str, value))
+    return str(value)
+
+
+def _attributes(attrs):
+    return ''.join(
+        ' %s="%s"' % (name.replace('_', '-'), escape(_value(value), {'"': '&quot;'}))
+        for (name, value) in sorted(attrs.items())
+        if value is not None
+    )
+
+
+def box(x, y, w, h):
+    """Path data for a w x h rectangle at (x, y)"""
+    return 'M%s,%sh%sv%sh%sZ' % (x, y, w, h, -w)
+
+
+def vertical(x, y, h):
+    """Path data for a vertical line of height h down from (x, y)"""
+    return 'M%s,%sv%s' % (x, y, h)
+
+
+class SvgWriter(object):
+    """Write an SVG document to handle, one element at a time.
+
+    Groups are opened with start() (or the group() context manager) and
+    closed with end(); close() ends any still open and the document.
+    """
+
+    def __init__(self, handle, width, height):
+        self.handle = handle
+        self.open = ['svg']
+        attrs = dict(SVG_NAMESPACES, width=width, height=height)
+        # Written by hand as the namespaced names need their colons.
+        self.handle.write('<svg%s><defs />' % ''.join(
+            ' %s="%s"' % (name, escape(_value(value), {'"': '&quot;'}))
+            for (name, value) in sorted(attrs.items())
+        ))
+
+    def start(self, tag, **attrs):
+        self.handle.write('<%s%s>' % (tag, _attributes(attrs)))
+        self.open.append(tag)
+
+    def end(self):
+        self.handle.write('</%s>' % self.open.pop())
+
+    @contextlib.contextmanager
+    def group(self, **attrs):
+        self.start('g', **attrs)
+        yield
+        self.end()
+
+    def element(self, tag, text=None, **attrs):
+        if text is None:
+            self.handle.write('<%s%s />' % (tag, _attributes(attrs)))
+        else:
+            self.handle.write('<%s%s>%s</%s>' % (tag, _attributes(attrs), escape(text), tag))
+
+    def line(self, start, end, **attrs):
+        self.element('line', x1=start[0], y1=start[1], x2=end[0], y2=end[1], **attrs)
+
+    def text(self, text, **attrs):
+        self.element('text', text=text, **attrs)
+
+    def path(self, d, **attrs):
+        """A path from a list of path data pieces, e.g. from box()"""
+        if d:
+            self.element('path', d=' '.join(d), **attrs)
+
+    def close(self):
+        while self.open:
+            self.end()
+
+
+class PathRuns(object):
+    """Collect path data for consecutive shapes, writing a single <path>
+    each time the style changes (and at flush()).
+    """
+
+    def __init__(self, svg, **attrs):
+        self.svg = svg
+        self.attrs = attrs
+        self.style = None
+        self.pieces = []
+
+    def add(self, piece, **style):
+        if style != self.style:
+            self.flush()
+            self.style = style
+        self.pieces.append(piece)
+
+    def flush(self):
+        if self.pieces:
+            attrs = dict(self.attrs)
+            attrs.update(self.style)
+            self.svg.path(self.pieces, **attrs)
+        self.pieces = []